@@ -12,10 +12,17 @@ from typing_extensions import Protocol
 
 from aiohttp import web
 
+from .abc import ABC
 from .allowed_hosts import AllowedHosts
-from .basic_auth import BasicAuth
+from .basic_auth import BasicAuth, HashedBasicAuth
 from .cloudflare import Cloudflare
+from .exceptions import rejections
 from .forwarded import ForwardedRelaxed, ForwardedStrict
+from .fused import Fused
+from .instrumentation import Histogram, HistogramSink
+from .log import LogLimiter, QueueLogging, error_log_limiter
+from .passwords import hash_password
+from .resolved import Resolved, resolved
 from .secure import Secure
 from .x_forwarded import XForwardedFiltered, XForwardedRelaxed, XForwardedStrict
 
@@ -24,9 +31,20 @@ class _Tool(Protocol):
     async def setup(self, app: web.Application) -> None: ...
 
 
-async def setup(app: web.Application, *tools: _Tool) -> None:
+async def setup(app: web.Application, *tools: _Tool, fuse: bool = False) -> None:
+    if not fuse:
+        for tool in tools:
+            await tool.setup(app)
+        return
+
+    fused = []
     for tool in tools:
-        await tool.setup(app)
+        if not isinstance(tool, ABC):
+            raise TypeError(f"{tool!r} cannot be fused")
+        fused.append(tool)
+    for tool in fused:
+        await tool.prepare(app)
+    app.middlewares.append(Fused(fused).middleware)
 
 
 __all__ = (
@@ -35,9 +53,19 @@ __all__ = (
     "Cloudflare",
     "ForwardedRelaxed",
     "ForwardedStrict",
+    "HashedBasicAuth",
+    "Histogram",
+    "HistogramSink",
+    "LogLimiter",
+    "QueueLogging",
+    "Resolved",
     "Secure",
     "XForwardedFiltered",
     "XForwardedRelaxed",
     "XForwardedStrict",
+    "error_log_limiter",
+    "hash_password",
+    "rejections",
+    "resolved",
     "setup",
 )
@@ -1,14 +1,102 @@
 import abc
+from collections import Counter
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, Optional
 
 from typing_extensions import NoReturn
 
 from aiohttp import web
 
+from .exceptions import RemoteError, _rejections
+from .instrumentation import OVERRIDE, PASS, REJECT, Sink
+from .resolved import Overrides, apply_overrides
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
 
 class ABC(abc.ABC):
-    @abc.abstractmethod
+    # A fused middleware applies pending overrides before running a tool
+    # which reads request.remote, request.scheme or request.host.
+    _reads_overrides = True
+    # Apply overrides by request.clone() or store them in the request for
+    # reading by resolved().
+    _clone = True
+    # Instrumentation is disabled unless a sink is set by instrument().
+    _sink: Optional[Sink] = None
+    _name = ""
+    # Created on the first rejection.
+    _rejections: "Optional[Counter[str]]" = None
+
     async def setup(self, app: web.Application) -> None:
-        pass  # pragma: no cover
+        await self.prepare(app)
+        app.middlewares.append(self.middleware)
+
+    async def prepare(self, app: web.Application) -> None:
+        """Register everything the tool needs except the middleware."""
+
+    @abc.abstractmethod
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        """Check the request.
+
+        Return overrides of remote, scheme and host or None if the
+        request should be passed as is, raise HTTP exception to reject.
+        """
+
+    def instrument(self, sink: Optional[Sink], name: Optional[str] = None) -> None:
+        """Report time, outcome and reason of every check to *sink*.
+
+        Pass None to disable the instrumentation.
+        """
+        self._sink = sink
+        self._name = name or type(self).__name__
+
+    async def process_instrumented(self, request: web.Request) -> Optional[Overrides]:
+        sink = self._sink
+        assert sink is not None
+        start = perf_counter()
+        try:
+            overrides = await self.process(request)
+        except Exception as exc:
+            elapsed = perf_counter() - start
+            # tools log RemoteError and raise HTTP error while handling it
+            cause = exc.__context__
+            if isinstance(cause, RemoteError):
+                reason = type(cause).__name__
+            else:
+                reason = type(exc).__name__
+            sink.record(self._name, elapsed, REJECT, reason)
+            raise
+        elapsed = perf_counter() - start
+        sink.record(self._name, elapsed, OVERRIDE if overrides else PASS, None)
+        return overrides
+
+    @property
+    def rejections(self) -> Dict[str, int]:
+        """Counts of requests rejected by the tool by error class name."""
+        return dict(self._rejections) if self._rejections is not None else {}
+
+    async def reject(self, request: web.Request, exc: RemoteError) -> NoReturn:
+        """Count and log *exc*, reject the request by :meth:`raise_error`."""
+        name = type(exc).__name__
+        counter = self._rejections
+        if counter is None:
+            counter = self._rejections = Counter()
+        counter[name] += 1
+        _rejections[name] += 1
+        exc.log(request)
+        await self.raise_error(request)
 
     async def raise_error(self, request: web.Request) -> NoReturn:
         raise web.HTTPBadRequest()
+
+    @web.middleware
+    async def middleware(
+        self, request: web.Request, handler: Handler
+    ) -> web.StreamResponse:
+        if self._sink is None:
+            overrides = await self.process(request)
+        else:
+            overrides = await self.process_instrumented(request)
+        if overrides:
+            request = apply_overrides(request, overrides, self._clone)
+        return await handler(request)
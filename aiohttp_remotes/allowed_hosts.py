@@ -1,8 +1,9 @@
-from typing import Awaitable, Callable, Iterable, Set, Union
+from typing import Iterable, Optional, Set, Union
 
 from aiohttp import web
 
 from .abc import ABC
+from .resolved import Overrides, has_overrides, resolved
 
 
 class ANY:
@@ -25,19 +26,12 @@ class AllowedHosts(ABC):
         self._allowed_hosts = real_allowed_hosts
         self._white_paths = set(white_paths)
 
-    async def setup(self, app: web.Application) -> None:
-        app.middlewares.append(self.middleware)
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        if request.path in self._white_paths:
+            return None
 
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
-        if (
-            request.path not in self._white_paths
-            and request.host not in self._allowed_hosts
-        ):
+        host = resolved(request).host if has_overrides(request) else request.host
+        if host not in self._allowed_hosts:
             return await self.raise_error(request)
 
-        return await handler(request)
+        return None
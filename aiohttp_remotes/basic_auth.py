@@ -1,64 +1,364 @@
+import abc
+import asyncio
 import base64
 import binascii
-from typing import Awaitable, Callable, Iterable
+import hashlib
+import hmac
+import logging
+import math
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Iterable, List, Mapping, Optional, Tuple
 
 from typing_extensions import NoReturn
 
 from aiohttp import hdrs, web
 
 from .abc import ABC
+from .cache import LRUCache
+from .log import logger
+from .passwords import check_hash, verify_password
+from .resolved import Overrides, has_overrides, resolved
 
 
-class BasicAuth(ABC):
+def _decode_credentials(auth_header: str) -> Optional[Tuple[str, str]]:
+    # Username and password from Basic Authorization header, None if
+    # the header is invalid
+    try:
+        secret = auth_header[6:].encode("utf-8")
+
+        auth_decoded = base64.decodebytes(secret).decode("utf-8")
+    except (UnicodeDecodeError, UnicodeEncodeError, binascii.Error):
+        return None
+
+    credentials = auth_decoded.split(":", maxsplit=1)
+
+    if len(credentials) != 2:
+        return None
+
+    return credentials[0], credentials[1]
+
+
+class FailureThrottle:
+    """Count failed attempts per client in fixed time windows.
+
+    A client is throttled after *max_failures* failures until the end
+    of the *window* seconds started by its first failure.  At most
+    *maxsize* clients are tracked, the least recently failed are
+    evicted.  All operations are O(1).
+    """
+
+    def __init__(
+        self,
+        max_failures: int,
+        window: float = 60.0,
+        maxsize: int = 65536,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if max_failures <= 0:
+            raise ValueError(f"max_failures should be positive, got {max_failures!r}")
+        if window <= 0:
+            raise ValueError(f"window should be positive, got {window!r}")
+        if maxsize <= 0:
+            raise ValueError(f"maxsize should be positive, got {maxsize!r}")
+        self._max_failures = max_failures
+        self._window = window
+        self._maxsize = maxsize
+        self._clock = clock
+        # client -> [failures, window start]
+        self._data: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.throttled = 0
+        self.evictions = 0
+
+    @property
+    def max_failures(self) -> int:
+        return self._max_failures
+
+    @property
+    def window(self) -> float:
+        return self._window
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def retry_after(self, client: str) -> float:
+        """Seconds until *client* is allowed to try again, 0 if it is."""
+        entry = self._data.get(client)
+        if entry is None:
+            return 0
+        failures, start = entry
+        left = start + self._window - self._clock()
+        if left <= 0:
+            del self._data[client]
+            return 0
+        if failures < self._max_failures:
+            return 0
+        self.throttled += 1
+        return left
+
+    def failed(self, client: str) -> None:
+        data = self._data
+        now = self._clock()
+        entry = data.get(client)
+        if entry is None or entry[1] + self._window <= now:
+            data[client] = [1, now]
+        else:
+            entry[0] += 1
+        data.move_to_end(client)
+        if len(data) > self._maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def succeeded(self, client: str) -> None:
+        self._data.pop(client, None)
+
+
+def _throttle(
+    max_failures: Optional[int], window: float, maxsize: int
+) -> Optional[FailureThrottle]:
+    if max_failures is None:
+        return None
+    return FailureThrottle(max_failures, window, maxsize)
+
+
+class BasicAuthBase(ABC):
+    _reads_overrides = False
+
     def __init__(
         self,
-        username: str,
-        password: str,
         realm: str,
         *,
         white_paths: Iterable[str] = (),
+        max_failures: Optional[int] = None,
+        failure_window: float = 60.0,
+        throttle_size: int = 65536,
     ) -> None:
-        self._username = username
-        self._password = password
         self._realm = realm
         self._white_paths = set(white_paths)
-
-    async def setup(self, app: web.Application) -> None:
-        app.middlewares.append(self.middleware)
+        self._throttle = _throttle(max_failures, failure_window, throttle_size)
+        # Throttling is keyed by request.remote set by forwarding tools
+        self._reads_overrides = self._throttle is not None
 
     async def raise_error(self, request: web.Request) -> NoReturn:
         raise web.HTTPUnauthorized(
             headers={hdrs.WWW_AUTHENTICATE: f"Basic realm={self._realm}"},
         )
 
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
+    @property
+    def throttle(self) -> Optional[FailureThrottle]:
+        return self._throttle
 
-        if request.path not in self._white_paths:
-            auth_header = request.headers.get(hdrs.AUTHORIZATION)
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        if request.path in self._white_paths:
+            return None
 
-            if auth_header is None or not auth_header.startswith("Basic "):
+        throttle = self._throttle
+        # Forwarding tools with clone=False store the client address in
+        # the request instead of overriding request.remote
+        if throttle is None:
+            remote = None
+        elif has_overrides(request):
+            remote = resolved(request).remote
+        else:
+            remote = request.remote
+        if throttle is None or remote is None:
+            if not await self.verify(request):
                 return await self.raise_error(request)
+            return None
 
-            try:
-                secret = auth_header[6:].encode("utf-8")
+        # Throttled clients are rejected before looking at the header
+        retry_after = throttle.retry_after(remote)
+        if retry_after:
+            raise web.HTTPTooManyRequests(
+                headers={hdrs.RETRY_AFTER: str(math.ceil(retry_after))}
+            )
 
-                auth_decoded = base64.decodebytes(secret).decode("utf-8")
-            except (UnicodeDecodeError, UnicodeEncodeError, binascii.Error):
-                return await self.raise_error(request)
+        if not await self.verify(request):
+            throttle.failed(remote)
+            return await self.raise_error(request)
 
-            credentials = auth_decoded.split(":", maxsplit=1)
+        throttle.succeeded(remote)
+        return None
 
-            if len(credentials) != 2:
-                return await self.raise_error(request)
+    @abc.abstractmethod
+    async def verify(self, request: web.Request) -> bool:
+        """Check credentials of the request."""
 
-            username, password = credentials
 
-            if username != self._username or password != self._password:
-                return await self.raise_error(request)
+class BasicAuth(BasicAuthBase):
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        realm: str,
+        *,
+        white_paths: Iterable[str] = (),
+        max_failures: Optional[int] = None,
+        failure_window: float = 60.0,
+        throttle_size: int = 65536,
+    ) -> None:
+        super().__init__(
+            realm,
+            white_paths=white_paths,
+            max_failures=max_failures,
+            failure_window=failure_window,
+            throttle_size=throttle_size,
+        )
+        self._username = username
+        self._password = password
+        # The header sent for the configured credentials, compared with
+        # the raw header without decoding
+        secret = base64.b64encode(f"{username}:{password}".encode("utf-8"))
+        self._token = b"Basic " + secret
+
+    async def verify(self, request: web.Request) -> bool:
+        auth_header = request.headers.get(hdrs.AUTHORIZATION)
+
+        if auth_header is None:
+            return False
+
+        raw = auth_header.encode("utf-8", "surrogateescape")
+        return hmac.compare_digest(raw, self._token) or self._check_decoded(auth_header)
+
+    def _check_decoded(self, auth_header: str) -> bool:
+        # Slow path for headers which differ from the expected token,
+        # e.g. wrapped base64, and for diagnostic of failures
+        if not auth_header.startswith("Basic "):
+            logger.debug("Basic auth failed: no Basic Authorization header")
+            return False
+
+        credentials = _decode_credentials(auth_header)
+
+        if credentials is None:
+            logger.debug("Basic auth failed: invalid Authorization header")
+            return False
+
+        username, password = credentials
+        same_username = hmac.compare_digest(
+            username.encode("utf-8"), self._username.encode("utf-8")
+        )
+        same_password = hmac.compare_digest(
+            password.encode("utf-8"), self._password.encode("utf-8")
+        )
+
+        if not (same_username and same_password):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Basic auth failed: wrong credentials for %r", username)
+            return False
+
+        return True
+
+
+class HashedBasicAuth(BasicAuthBase):
+    """Basic authentication against a table of password hashes."""
+
+    def __init__(
+        self,
+        users: Mapping[str, str],
+        realm: str,
+        *,
+        white_paths: Iterable[str] = (),
+        cache_size: int = 1024,
+        executor: Optional[Executor] = None,
+        max_workers: int = 2,
+        max_failures: Optional[int] = None,
+        failure_window: float = 60.0,
+        throttle_size: int = 65536,
+    ) -> None:
+        for encoded in users.values():
+            check_hash(encoded)
+        super().__init__(
+            realm,
+            white_paths=white_paths,
+            max_failures=max_failures,
+            failure_window=failure_window,
+            throttle_size=throttle_size,
+        )
+        if max_workers <= 0:
+            raise ValueError(f"max_workers should be positive, got {max_workers!r}")
+        self._users = dict(users)
+        # Hashing is slow, the default executor of the loop is not used to
+        # not starve getaddrinfo() and file I/O by a burst of bad passwords
+        self._executor = executor
+        self._max_workers = max_workers
+        self._own_executor: Optional[ThreadPoolExecutor] = None
+        # Digests of recently verified Authorization headers
+        self._verified_cache: Optional[LRUCache[bytes, bool]] = (
+            LRUCache(cache_size) if cache_size else None
+        )
+        # Unknown users are verified against a hash of another user to
+        # make timing the same as for known ones
+        self._dummy = next(iter(self._users.values()), None)
+
+    @property
+    def verified_cache(self) -> Optional[LRUCache[bytes, bool]]:
+        return self._verified_cache
+
+    async def prepare(self, app: web.Application) -> None:
+        app.on_cleanup.append(self._shutdown_executor)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is not None:
+            return self._executor
+        executor = self._own_executor
+        if executor is None:
+            executor = self._own_executor = ThreadPoolExecutor(
+                self._max_workers, thread_name_prefix="aiohttp_remotes-auth"
+            )
+        return executor
+
+    async def _shutdown_executor(self, app: web.Application) -> None:
+        executor = self._own_executor
+        if executor is not None:
+            self._own_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def verify(self, request: web.Request) -> bool:
+        auth_header = request.headers.get(hdrs.AUTHORIZATION)
+
+        if auth_header is None or not auth_header.startswith("Basic "):
+            return False
+
+        cache = self._verified_cache
+        if cache is not None:
+            key = hashlib.sha256(
+                auth_header.encode("utf-8", "surrogateescape")
+            ).digest()
+            if cache.get(key):
+                return True
+
+        credentials = _decode_credentials(auth_header)
+
+        if credentials is None:
+            return False
+
+        username, password = credentials
+        encoded = self._users.get(username)
+        target = self._dummy if encoded is None else encoded
+
+        if target is None:
+            return False
+
+        loop = asyncio.get_running_loop()
+        try:
+            verified = await loop.run_in_executor(
+                self._get_executor(), verify_password, password, target
+            )
+        except (ValueError, OverflowError):
+            # Rejected by hashlib despite check_hash(), a broken entry
+            # should not turn into a server error
+            logger.exception("Basic auth failed: cannot verify password hash")
+            return False
+
+        if not verified or encoded is None:
+            return False
 
-        return await handler(request)
+        if cache is not None:
+            cache.set(key, True)
+        return True
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded mapping which evicts the least recently used entry.
+
+    The cache is bounded by the number of entries and optionally by the
+    total size of entries given to :meth:`set`.  Hits, misses and
+    evictions are counted to help with sizing.
+    """
+
+    def __init__(self, maxsize: int, maxbytes: Optional[int] = None) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"maxsize should be positive, got {maxsize!r}")
+        if maxbytes is not None and maxbytes <= 0:
+            raise ValueError(f"maxbytes should be positive, got {maxbytes!r}")
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._sizes: Dict[K, int] = {}
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def maxbytes(self) -> Optional[int]:
+        return self._maxbytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V, size: int = 0) -> None:
+        maxbytes = self._maxbytes
+        if maxbytes is not None and size > maxbytes:
+            return
+        data = self._data
+        sizes = self._sizes
+        if key in data:
+            self._nbytes -= sizes.pop(key, 0)
+        data[key] = value
+        data.move_to_end(key)
+        if size:
+            sizes[key] = size
+            self._nbytes += size
+        while len(data) > self._maxsize or (
+            maxbytes is not None and self._nbytes > maxbytes
+        ):
+            old, _ = data.popitem(last=False)
+            self._nbytes -= sizes.pop(old, 0)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._sizes.clear()
+        self._nbytes = 0
@@ -1,5 +1,12 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import suppress
 from ipaddress import ip_address, ip_network
-from typing import Awaitable, Callable, Optional, Set
+from typing import AsyncIterator, Callable, Optional, Set, Tuple, Union
 
 import aiohttp
 from aiohttp import web
@@ -7,12 +14,53 @@ from aiohttp import web
 from .abc import ABC
 from .exceptions import IPNetwork
 from .log import logger
+from .resolved import Overrides, has_overrides, resolved
+from .utils import TrustedElement
+
+StrPath = Union[str, "os.PathLike[str]"]
+
+IPS_V4_URL = "https://www.cloudflare.com/ips-v4"
+IPS_V6_URL = "https://www.cloudflare.com/ips-v6"
+
+# Without refresh_interval a snapshot younger than this (or than
+# snapshot_max_age if given) is used as is, an older one is refreshed
+# once after a random delay up to SNAPSHOT_REFRESH_JITTER seconds.
+SNAPSHOT_FRESHNESS = 24 * 3600.0
+SNAPSHOT_REFRESH_JITTER = 5.0
 
 
 class Cloudflare(ABC):
-    def __init__(self, client: Optional[aiohttp.ClientSession] = None) -> None:
+    def __init__(
+        self,
+        client: Optional[aiohttp.ClientSession] = None,
+        *,
+        refresh_interval: Optional[float] = None,
+        snapshot: Optional[StrPath] = None,
+        snapshot_max_age: Optional[float] = None,
+        fetch_timeout: Optional[float] = 30.0,
+        fetch_retries: int = 0,
+        fetch_backoff: float = 1.0,
+        clone: bool = True,
+    ) -> None:
+        if refresh_interval is not None and refresh_interval <= 0:
+            raise ValueError(
+                f"refresh_interval should be positive, got {refresh_interval!r}"
+            )
+        if fetch_retries < 0:
+            raise ValueError(
+                f"fetch_retries should be non-negative, got {fetch_retries!r}"
+            )
         self._ip_networks: Set[IPNetwork] = set()
+        self._trusted = TrustedElement()
         self._client = client
+        self._refresh_interval = refresh_interval
+        self._snapshot = snapshot
+        self._snapshot_max_age = snapshot_max_age
+        self._fetched_at = 0.0
+        self._fetch_timeout = fetch_timeout
+        self._fetch_retries = fetch_retries
+        self._fetch_backoff = fetch_backoff
+        self._clone = clone
 
     def _parse_mask(self, text: str) -> Set[IPNetwork]:
         ret = set()
@@ -25,38 +73,203 @@ class Cloudflare(ABC):
             ret.add(real_mask)
         return ret
 
-    async def setup(self, app: web.Application) -> None:
+    async def _fetch_mask(
+        self, client: aiohttp.ClientSession, url: str
+    ) -> Set[IPNetwork]:
+        async with client.get(url) as response:
+            response.raise_for_status()
+            return self._parse_mask(await response.text())
+
+    async def _fetch_once(self) -> Set[IPNetwork]:
         if self._client is not None:  # pragma: no branch
             client = self._client
         else:
             client = aiohttp.ClientSession()  # pragma: no cover
         try:
-            async with client.get("https://www.cloudflare.com/ips-v4") as response:
-                self._ip_networks |= self._parse_mask(await response.text())
-            async with client.get("https://www.cloudflare.com/ips-v6") as response:
-                self._ip_networks |= self._parse_mask(await response.text())
+            ipv4, ipv6 = await asyncio.gather(
+                self._fetch_mask(client, IPS_V4_URL),
+                self._fetch_mask(client, IPS_V6_URL),
+            )
         finally:
             if self._client is None:  # pragma: no cover
                 await client.close()
+        return ipv4 | ipv6
+
+    async def _fetch(self) -> Set[IPNetwork]:
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(self._fetch_once(), self._fetch_timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if attempt >= self._fetch_retries:
+                    raise
+                delay = self._fetch_backoff * 2**attempt
+                attempt += 1
+                logger.warning(
+                    "Cloudflare networks fetch failed: %r, retry %d in %.2f s",
+                    exc,
+                    attempt,
+                    delay,
+                )
+                await asyncio.sleep(delay)
 
-        if not self._ip_networks:
-            raise RuntimeError("No networks are available")
-        app.middlewares.append(self.middleware)
+    def _update(self, ip_networks: Set[IPNetwork]) -> None:
+        # The index is built before assignment, the middleware sees either
+        # the old table or the new one.
+        trusted = TrustedElement(ip_networks)
+        self._ip_networks = ip_networks
+        self._trusted = trusted
 
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
-        remote = request.remote
+    def _read_snapshot(self) -> Optional[Tuple[float, Set[IPNetwork]]]:
+        assert self._snapshot is not None
+        try:
+            with open(self._snapshot, encoding="utf-8") as f:
+                data = json.load(f)
+            fetched_at = float(data["fetched_at"])
+            ip_networks = {ip_network(mask) for mask in data["networks"]}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, KeyError):
+            logger.warning(
+                "Cannot read Cloudflare snapshot %s", self._snapshot, exc_info=True
+            )
+            return None
+        return fetched_at, ip_networks
+
+    def _write_snapshot(self, fetched_at: float, ip_networks: Set[IPNetwork]) -> None:
+        assert self._snapshot is not None
+        path = os.fspath(self._snapshot)
+        data = {
+            "fetched_at": fetched_at,
+            "networks": sorted(str(network) for network in ip_networks),
+        }
+        # Write a temporary file next to the snapshot and rename it, readers
+        # in other processes never see a partially written file.
+        fd, tmp = tempfile.mkstemp(
+            prefix=".cloudflare-", dir=os.path.dirname(path) or None
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(tmp)
+            raise
+
+    async def _load_snapshot(self) -> Optional[Tuple[float, Set[IPNetwork]]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._read_snapshot)
+
+    async def _save_snapshot(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, self._write_snapshot, self._fetched_at, self._ip_networks
+            )
+        except OSError:
+            logger.exception("Cannot write Cloudflare snapshot %s", self._snapshot)
+
+    async def prepare(self, app: web.Application) -> None:
+        started = time.monotonic()
+        snapshot = None
+        if self._snapshot is not None:
+            snapshot = await self._load_snapshot()
+            if snapshot is not None:
+                age = time.time() - snapshot[0]
+                if not snapshot[1] or (
+                    self._snapshot_max_age is not None and age > self._snapshot_max_age
+                ):
+                    snapshot = None
+
+        if snapshot is not None:
+            self._fetched_at, ip_networks = snapshot
+            self._update(ip_networks)
+            age = time.time() - self._fetched_at
+            if self._refresh_interval is not None:
+                delay = max(self._refresh_interval - age, 0)
+                app.cleanup_ctx.append(self._refresh_ctx(delay))
+            elif age > (
+                SNAPSHOT_FRESHNESS
+                if self._snapshot_max_age is None
+                else self._snapshot_max_age
+            ):
+                app.cleanup_ctx.append(self._refresh_ctx(0.0))
+            source = "snapshot"
+        else:
+            ip_networks = await self._fetch()
+            if not ip_networks:
+                raise RuntimeError("No networks are available")
+            self._fetched_at = time.time()
+            self._update(ip_networks)
+            if self._snapshot is not None:
+                await self._save_snapshot()
+            if self._refresh_interval is not None:
+                app.cleanup_ctx.append(self._refresh_ctx(self._refresh_interval))
+            source = "fetch"
+        logger.info(
+            "Cloudflare setup took %.3f s, %d networks loaded from %s",
+            time.monotonic() - started,
+            len(self._ip_networks),
+            source,
+        )
+
+    def _refresh_ctx(
+        self, delay: float
+    ) -> Callable[[web.Application], AsyncIterator[None]]:
+        async def ctx(app: web.Application) -> AsyncIterator[None]:
+            task = asyncio.create_task(self._refresh(delay))
+            yield
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+        return ctx
+
+    async def _refresh(self, delay: float) -> None:
+        while True:
+            if self._snapshot is not None:
+                # Spread workers sharing the snapshot, the first one fetches
+                # and the rest pick its result up from the file.
+                if self._refresh_interval is not None:
+                    delay += random.uniform(0, self._refresh_interval / 10)
+                else:
+                    delay += random.uniform(0, SNAPSHOT_REFRESH_JITTER)
+            await asyncio.sleep(delay)
+            await self._refresh_once()
+            if self._refresh_interval is None:
+                return
+            delay = self._refresh_interval
+
+    async def _refresh_once(self) -> None:
+        if self._snapshot is not None:
+            snapshot = await self._load_snapshot()
+            if snapshot is not None and snapshot[0] > self._fetched_at and snapshot[1]:
+                self._fetched_at, ip_networks = snapshot
+                self._update(ip_networks)
+                return
+        try:
+            ip_networks = await self._fetch()
+        except Exception:
+            logger.exception("Cloudflare networks refresh failed")
+            return
+        if not ip_networks:
+            logger.error("Cloudflare networks refresh returned no networks")
+            return
+        self._fetched_at = time.time()
+        self._update(ip_networks)
+        if self._snapshot is not None:
+            await self._save_snapshot()
+
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        remote = resolved(request).remote if has_overrides(request) else request.remote
         assert remote is not None, "HTTP transport is closed"
         remote_ip = ip_address(remote)
 
-        for network in self._ip_networks:
-            if remote_ip in network:
-                request = request.clone(remote=request.headers["CF-CONNECTING-IP"])
-                return await handler(request)
+        if self._trusted.contains_ip(remote_ip):
+            return {"remote": request.headers["CF-CONNECTING-IP"]}
 
         msg = "Not cloudflare: %(remote_ip)s"
         context = {"remote_ip": remote_ip}
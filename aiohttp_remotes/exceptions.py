@@ -1,10 +1,12 @@
 import builtins
+import logging
+from collections import Counter
 from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
-from typing import Any, Dict, Sequence, Union, cast
+from typing import Any, Dict, Sequence, Tuple, Union, cast
 
 from aiohttp import web
 
-from .log import logger
+from .log import error_log_limiter, log_suppressed, logger
 
 IPAddress = Union[IPv4Address, IPv6Address]
 IPNetwork = Union[IPv4Network, IPv6Network]
@@ -12,8 +14,32 @@ IPRule = Union[IPAddress, IPNetwork]
 Trusted = Sequence[Union["builtins.ellipsis", Sequence[IPRule]]]
 
 
+# rejected requests by RemoteError class name, for all tools
+_rejections: "Counter[str]" = Counter()
+
+
+def rejections() -> Dict[str, int]:
+    """Return counts of rejected requests by error class name."""
+    return dict(_rejections)
+
+
 class RemoteError(Exception):
     def log(self, request: web.Request) -> None:
+        if not logger.isEnabledFor(logging.ERROR):
+            return
+        name = type(self).__name__
+        suppressed = error_log_limiter.allow(name)
+        if suppressed is None:
+            return
+        if suppressed:
+            log_suppressed(name, suppressed, request=request)
+        msg, context = self.message()
+        extra = context.copy()
+        extra["request"] = request
+        logger.error(msg, context, extra=extra)
+
+    def message(self) -> Tuple[str, Dict[str, Any]]:
+        """Return log message and its context."""
         raise NotImplementedError  # pragma: no cover
 
 
@@ -22,12 +48,56 @@ class TooManyHeaders(RemoteError):
     def header(self) -> str:
         return cast(str, self.args[0])
 
-    def log(self, request: web.Request) -> None:
+    def message(self) -> Tuple[str, Dict[str, Any]]:
         msg = "Too many headers for %(header)s"
         context: Dict[str, Any] = {"header": self.header}
-        extra = context.copy()
-        extra["request"] = request
-        logger.error(msg, context, extra=extra)
+        return msg, context
+
+
+class HeaderTooLarge(RemoteError):
+    @property
+    def header(self) -> str:
+        return cast(str, self.args[0])
+
+    @property
+    def size(self) -> int:
+        return cast(int, self.args[1])
+
+    @property
+    def limit(self) -> int:
+        return cast(int, self.args[2])
+
+    def message(self) -> Tuple[str, Dict[str, Any]]:
+        msg = "Too large %(header)s header: %(size)s, limit %(limit)s"
+        context: Dict[str, Any] = {
+            "header": self.header,
+            "size": self.size,
+            "limit": self.limit,
+        }
+        return msg, context
+
+
+class TooManyElements(RemoteError):
+    @property
+    def header(self) -> str:
+        return cast(str, self.args[0])
+
+    @property
+    def actual(self) -> int:
+        return cast(int, self.args[1])
+
+    @property
+    def limit(self) -> int:
+        return cast(int, self.args[2])
+
+    def message(self) -> Tuple[str, Dict[str, Any]]:
+        msg = "Too many %(header)s elements: %(actual)s, limit %(limit)s"
+        context: Dict[str, Any] = {
+            "header": self.header,
+            "actual": self.actual,
+            "limit": self.limit,
+        }
+        return msg, context
 
 
 class IncorrectIPCount(RemoteError):
@@ -39,12 +109,10 @@ class IncorrectIPCount(RemoteError):
     def actual(self) -> Sequence[IPAddress]:
         return cast(Sequence[IPAddress], self.args[1])
 
-    def log(self, request: web.Request) -> None:
+    def message(self) -> Tuple[str, Dict[str, Any]]:
         msg = "Too many X-Forwarded-For values: %(actual)s, expected %(expected)s"
         context: Dict[str, Any] = {"actual": self.actual, "expected": self.expected}
-        extra = context.copy()
-        extra["request"] = request
-        logger.error(msg, context, extra=extra)
+        return msg, context
 
 
 class IncorrectForwardedCount(RemoteError):
@@ -56,12 +124,10 @@ class IncorrectForwardedCount(RemoteError):
     def actual(self) -> int:
         return cast(int, self.args[1])
 
-    def log(self, request: web.Request) -> None:
+    def message(self) -> Tuple[str, Dict[str, Any]]:
         msg = "Too many Forwarded values: %(actual)s, " "expected %(expected)s"
         context: Dict[str, Any] = {"actual": self.actual, "expected": self.expected}
-        extra = context.copy()
-        extra["request"] = request
-        logger.error(msg, context, extra=extra)
+        return msg, context
 
 
 class IncorrectProtoCount(RemoteError):
@@ -73,12 +139,10 @@ class IncorrectProtoCount(RemoteError):
     def actual(self) -> Sequence[str]:
         return cast(Sequence[str], self.args[1])
 
-    def log(self, request: web.Request) -> None:
+    def message(self) -> Tuple[str, Dict[str, Any]]:
         msg = "Too many X-Forwarded-Proto values: %(actual)s, " "expected %(expected)s"
         context: Dict[str, Any] = {"actual": self.actual, "expected": self.expected}
-        extra = context.copy()
-        extra["request"] = request
-        logger.error(msg, context, extra=extra)
+        return msg, context
 
 
 class IncorrectHostCount(RemoteError):
@@ -90,12 +154,10 @@ class IncorrectHostCount(RemoteError):
     def actual(self) -> Sequence[str]:
         return cast(Sequence[str], self.args[1])
 
-    def log(self, request: web.Request) -> None:
+    def message(self) -> Tuple[str, Dict[str, Any]]:
         msg = "Too many X-Forwarded-Host values: %(actual)s, " "expected %(expected)s"
         context: Dict[str, Any] = {"actual": self.actual, "expected": self.expected}
-        extra = context.copy()
-        extra["request"] = request
-        logger.error(msg, context, extra=extra)
+        return msg, context
 
 
 class UntrustedIP(RemoteError):
@@ -107,10 +169,7 @@ class UntrustedIP(RemoteError):
     def trusted(self) -> Sequence[IPAddress]:
         return cast(Sequence[IPAddress], self.args[1])
 
-    def log(self, request: web.Request) -> None:
+    def message(self) -> Tuple[str, Dict[str, Any]]:
         msg = "Untrusted IP: %(ip)s, trusted: %(trusted)s"
         context: Dict[str, Any] = {"ip": self.ip, "trusted": self.trusted}
-        extra = context.copy()
-        extra["request"] = request
-        logger.error(msg, context, extra=extra)
-        logger.error(msg, context, extra=extra)
+        return msg, context
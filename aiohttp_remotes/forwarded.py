@@ -1,85 +1,234 @@
+import re
 from ipaddress import ip_address
-from typing import Awaitable, Callable, Iterable
+from typing import Iterable, List, Optional, Sequence, Tuple
 
-from aiohttp import web
+from aiohttp import hdrs, web
 
 from .abc import ABC
+from .cache import LRUCache
 from .exceptions import IncorrectForwardedCount, RemoteError
-from .utils import TrustedOrig, parse_trusted_list, remote_ip
-
-
-class ForwardedRelaxed(ABC):
-    def __init__(self, num: int = 1) -> None:
+from .resolved import Overrides
+from .utils import (
+    HeaderParsing,
+    PeerCache,
+    TrustedOrig,
+    VerdictCaching,
+    count_elements,
+    parse_trusted_list,
+    remote_ip,
+)
+
+# for, proto and host of a forwarded-element, None if missing
+ForwardedElem = Tuple[Optional[str], Optional[str], Optional[str]]
+# raw Forwarded header values -> parsed elements
+ForwardedCache = LRUCache[Tuple[str, ...], Tuple[ForwardedElem, ...]]
+
+# RFC 7239 grammar, the same as used by aiohttp.web.BaseRequest.forwarded
+_TOKEN = r"[0-9A-Za-z!#$%&'*+.^_`|~-]+"
+_QUOTED_STRING = r'"(?:\\[\t !-~]|[\t !#-~])*"'
+_PAIR_RE = re.compile(rf"({_TOKEN})=({_TOKEN}|{_QUOTED_STRING})(:\d{{1,4}})?")
+_UNESCAPE_RE = re.compile(r"\\([\t !-~])")
+
+
+def _parse_forwarded(
+    values: Sequence[str], limit: Optional[int] = None
+) -> Tuple[ForwardedElem, ...]:
+    # Single pass over the header values, only for, proto and host are
+    # kept.  Parsing stops after limit elements.
+    elems: List[ForwardedElem] = []
+    for value in values:
+        length = len(value)
+        pos = 0
+        need_separator = False
+        for_ = proto = host = None
+        while 0 <= pos < length:
+            match = _PAIR_RE.match(value, pos)
+            if match is not None:
+                if need_separator:
+                    # bad syntax here, skip to next comma
+                    pos = value.find(",", pos)
+                    continue
+                name = match.group(1).lower()
+                if name in ("for", "proto", "host"):
+                    val = match.group(2)
+                    if val[0] == '"':
+                        val = _UNESCAPE_RE.sub(r"\1", val[1:-1])
+                    port = match.group(3)
+                    if port:
+                        val += port
+                    if name == "for":
+                        for_ = val
+                    elif name == "proto":
+                        proto = val
+                    else:
+                        host = val
+                pos = match.end()
+                need_separator = True
+            elif value[pos] == ",":
+                elems.append((for_, proto, host))
+                if limit is not None and len(elems) >= limit:
+                    return tuple(elems)
+                for_ = proto = host = None
+                need_separator = False
+                pos += 1
+            elif value[pos] == ";":
+                need_separator = False
+                pos += 1
+            elif value[pos] in " \t":
+                pos += 1
+            else:
+                # bad syntax here, skip to next comma
+                pos = value.find(",", pos)
+        elems.append((for_, proto, host))
+        if limit is not None and len(elems) >= limit:
+            break
+    return tuple(elems)
+
+
+def _node_address(node: str) -> Optional[str]:
+    # Strip brackets and port from a node, None for "unknown" and
+    # obfuscated identifiers
+    if node.startswith("["):
+        end = node.find("]")
+        if end > 0:
+            return node[1:end]
+        return node
+    if node.startswith("_") or node.lower() == "unknown":
+        return None
+    if node.count(":") == 1:
+        # IPv4 with port, bare IPv6 is left as is
+        return node.partition(":")[0]
+    return node
+
+
+class ForwardedBase(ABC, HeaderParsing[ForwardedCache]):
+    _reads_overrides = False
+
+    def get_forwarded(
+        self, request: web.Request, limit: Optional[int] = None
+    ) -> Tuple[ForwardedElem, ...]:
+        values: List[str] = request.headers.getall(hdrs.FORWARDED, [])
+        if not values:
+            return ()
+        self._header_limits.check(hdrs.FORWARDED, values)
+        cache = self._header_cache
+        if cache is None:
+            return _parse_forwarded(values, limit)
+        key = tuple(values)
+        elems = cache.get(key)
+        if elems is None:
+            elems = _parse_forwarded(values, limit)
+            cache.set(key, elems, sum(map(len, values)))
+        return elems
+
+
+class ForwardedRelaxed(ForwardedBase):
+    def __init__(
+        self,
+        num: int = 1,
+        *,
+        clone: bool = True,
+        max_header_size: Optional[int] = None,
+        max_elements: Optional[int] = None,
+        header_cache_size: int = 0,
+        header_cache_bytes: int = 1 << 20,
+    ) -> None:
         self._num = num
+        self._clone = clone
+        self._setup_headers(
+            ForwardedCache,
+            header_cache_size,
+            header_cache_bytes,
+            max_header_size,
+            max_elements,
+        )
+
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        try:
+            forwarded = self.get_forwarded(request)
+        except RemoteError as exc:
+            return await self.reject(request, exc)
 
-    async def setup(self, app: web.Application) -> None:
-        app.middlewares.append(self.middleware)
-
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
         overrides = {}
 
-        for elem in reversed(request.forwarded[-self._num :]):
-            for_ = elem.get("for")
+        for for_, proto, host in reversed(forwarded[-self._num :]):
             if for_:
-                overrides["remote"] = for_
-            proto = elem.get("proto")
+                remote = _node_address(for_)
+                if remote is not None:
+                    overrides["remote"] = remote
             if proto is not None:
                 overrides["scheme"] = proto
-            host = elem.get("host")
             if host is not None:
                 overrides["host"] = host
 
-        request = request.clone(**overrides)  # type: ignore[arg-type]
-        return await handler(request)
+        return overrides
 
 
-class ForwardedStrict(ABC):
-    def __init__(self, trusted: TrustedOrig, *, white_paths: Iterable[str] = ()):
+class ForwardedStrict(ForwardedBase, VerdictCaching):
+    def __init__(
+        self,
+        trusted: TrustedOrig,
+        *,
+        white_paths: Iterable[str] = (),
+        verdict_cache_size: int = 0,
+        clone: bool = True,
+        max_header_size: Optional[int] = None,
+        max_elements: Optional[int] = None,
+        header_cache_size: int = 0,
+        header_cache_bytes: int = 1 << 20,
+    ):
         self._trusted = parse_trusted_list(trusted)
         self._white_paths = set(white_paths)
-
-    async def setup(self, app: web.Application) -> None:
-        app.middlewares.append(self.middleware)
-
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
+        self._clone = clone
+        self._setup_verdict_cache(verdict_cache_size)
+        self._peer_cache = PeerCache(self._trusted)
+        self._setup_headers(
+            ForwardedCache,
+            header_cache_size,
+            header_cache_bytes,
+            max_header_size,
+            max_elements,
+        )
+
+    async def process(self, request: web.Request) -> Optional[Overrides]:
         if request.path in self._white_paths:
-            return await handler(request)
+            return None
         try:
             overrides = {}
 
-            forwarded = request.forwarded
-            if len(self._trusted) != len(forwarded):
-                raise IncorrectForwardedCount(len(self._trusted), len(forwarded))
+            # One element more than trusted is enough to detect a mismatch
+            expected = len(self._trusted)
+            forwarded = self.get_forwarded(request, expected + 1)
+            if expected != len(forwarded):
+                actual = len(forwarded)
+                if actual > expected:
+                    # parsing stopped early, count the rest by commas
+                    values = request.headers.getall(hdrs.FORWARDED)
+                    actual = max(actual, count_elements(values))
+                raise IncorrectForwardedCount(expected, actual)
 
             assert request.transport is not None
-            peer_ip, *_ = request.transport.get_extra_info("peername")
-            ips = [ip_address(peer_ip)]
+            peer, first = self._peer_cache.get(request.transport)
+            ips = [peer]
 
-            for elem in reversed(request.forwarded):
-                for_ = elem.get("for")
+            for for_, proto, host in reversed(forwarded):
                 if for_:
-                    ips.append(ip_address(for_))
-                proto = elem.get("proto")
+                    node = _node_address(for_)
+                    if node is not None:
+                        try:
+                            ips.append(ip_address(node))
+                        except ValueError:
+                            raise web.HTTPBadRequest(
+                                reason=f"Invalid {hdrs.FORWARDED} header"
+                            )
                 if proto is not None:
                     overrides["scheme"] = proto
-                host = elem.get("host")
                 if host is not None:
                     overrides["host"] = host
 
-                overrides["remote"] = str(remote_ip(self._trusted, ips))
+            ip = remote_ip(self._trusted, ips, self._verdict_cache, first)
+            overrides["remote"] = str(ip)
 
-            request = request.clone(**overrides)  # type: ignore[arg-type]
-            return await handler(request)
+            return overrides
         except RemoteError as exc:
-            exc.log(request)
-            return await self.raise_error(request)
+            return await self.reject(request, exc)
@@ -0,0 +1,46 @@
+from typing import Iterable
+
+from aiohttp import web
+
+from .abc import ABC, Handler
+from .resolved import Overrides, apply_overrides
+
+
+class Fused:
+    """Run checks of several tools in a single middleware.
+
+    Overrides are accumulated and applied at once.  A tool which reads
+    overridden attributes does it by resolved(), so pending overrides are
+    stored in the request before it runs.  The request is cloned at most
+    once, at the end and only if a tool which produced overrides is
+    configured to clone.
+    """
+
+    def __init__(self, tools: Iterable[ABC]) -> None:
+        self._tools = tuple(tools)
+
+    @web.middleware
+    async def middleware(
+        self, request: web.Request, handler: Handler
+    ) -> web.StreamResponse:
+        pending: Overrides = {}
+        # all overrides, for the final clone
+        produced: Overrides = {}
+        clone = False
+        for tool in self._tools:
+            if pending and tool._reads_overrides:
+                request = apply_overrides(request, pending, False)
+                pending = {}
+            if tool._sink is None:
+                overrides = await tool.process(request)
+            else:
+                overrides = await tool.process_instrumented(request)
+            if overrides:
+                pending.update(overrides)
+                produced.update(overrides)
+                clone = clone or tool._clone
+        if clone:
+            request = apply_overrides(request, produced, True)
+        elif pending:
+            request = apply_overrides(request, pending, False)
+        return await handler(request)
@@ -0,0 +1,109 @@
+import bisect
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from typing_extensions import Protocol
+
+PASS = "pass"
+OVERRIDE = "override"
+REJECT = "reject"
+
+# upper bounds of histogram buckets in seconds, from 1 usec to 1 sec
+DEFAULT_BOUNDS = tuple(m * 10.0**e for e in range(-6, 0) for m in (1, 2, 5)) + (1.0,)
+
+
+class Sink(Protocol):
+    def record(
+        self, name: str, elapsed: float, outcome: str, reason: Optional[str]
+    ) -> None:
+        """Record a single check of a request by a tool.
+
+        *outcome* is one of ``"pass"``, ``"override"`` and ``"reject"``,
+        *reason* is the name of the error class for rejections.
+        """
+
+
+class Histogram:
+    """Latency distribution and outcomes of a single tool."""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS) -> None:
+        self._bounds = tuple(bounds)
+        # the last bucket is for values above all bounds
+        self._buckets = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.outcomes: "Counter[str]" = Counter()
+        self.reasons: "Counter[str]" = Counter()
+
+    @property
+    def bounds(self) -> Sequence[float]:
+        return self._bounds
+
+    @property
+    def buckets(self) -> List[int]:
+        return list(self._buckets)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, elapsed: float, outcome: str, reason: Optional[str]) -> None:
+        self._buckets[bisect.bisect_left(self._bounds, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.outcomes[outcome] += 1
+        if reason is not None:
+            self.reasons[reason] += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the *q* quantile.
+
+        Values above the last bound are reported as the maximum seen.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f"q should be in [0, 1] range, got {q!r}")
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self._buckets):
+            seen += count
+            if count and seen >= rank:
+                if i < len(self._bounds):
+                    return min(self._bounds[i], self.max)
+                break
+        return self.max
+
+
+class HistogramSink:
+    """In-memory sink keeping a :class:`Histogram` per tool name."""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS) -> None:
+        self._bounds = tuple(bounds)
+        self._histograms: Dict[str, Histogram] = {}
+
+    def record(
+        self, name: str, elapsed: float, outcome: str, reason: Optional[str]
+    ) -> None:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(self._bounds)
+        histogram.add(elapsed, outcome, reason)
+
+    def __getitem__(self, name: str) -> Histogram:
+        return self._histograms[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._histograms
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._histograms)
+
+    def __len__(self) -> int:
+        return len(self._histograms)
+
+    def clear(self) -> None:
+        self._histograms.clear()
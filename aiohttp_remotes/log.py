@@ -1,3 +1,263 @@
+import asyncio
 import logging
+import queue
+import time
+from contextlib import suppress
+from logging.handlers import QueueHandler, QueueListener
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from aiohttp import web
 
 logger = logging.getLogger(__package__)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "last", "seen", "suppressed")
+
+    def __init__(self, tokens: float, last: float) -> None:
+        self.tokens = tokens
+        self.last = last
+        self.seen = 0
+        self.suppressed = 0
+
+
+class LogLimiter:
+    """Sampling and token bucket rate limit of log messages per key.
+
+    Every *sample*-th message of a key is considered, the considered
+    messages are logged at most *rate* per second with bursts up to
+    *burst* messages.  *rate* ``None`` (default) disables the rate limit.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: int = 20,
+        sample: int = 1,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._clock = clock
+        self._buckets: Dict[str, _Bucket] = {}
+        self.configure(rate, burst, sample)
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+
+    @property
+    def burst(self) -> int:
+        return self._burst
+
+    @property
+    def sample(self) -> int:
+        return self._sample
+
+    def configure(
+        self, rate: Optional[float] = None, burst: int = 20, sample: int = 1
+    ) -> None:
+        if rate is not None and rate <= 0:
+            raise ValueError(f"rate should be positive, got {rate!r}")
+        if burst <= 0:
+            raise ValueError(f"burst should be positive, got {burst!r}")
+        if sample <= 0:
+            raise ValueError(f"sample should be positive, got {sample!r}")
+        self._rate = rate
+        self._burst = burst
+        self._sample = sample
+        self._buckets.clear()
+
+    def suppressed(self, key: str) -> int:
+        """Number of messages suppressed since the last logged one."""
+        bucket = self._buckets.get(key)
+        return bucket.suppressed if bucket is not None else 0
+
+    def allow(self, key: str) -> Optional[int]:
+        """Check if a message for *key* should be logged.
+
+        Return None if the message is suppressed, otherwise the number
+        of messages suppressed since the previous logged one.
+        """
+        if self._rate is None and self._sample == 1:
+            return 0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self._burst, self._clock())
+        seen = bucket.seen
+        bucket.seen = seen + 1
+        if seen % self._sample:
+            bucket.suppressed += 1
+            return None
+        rate = self._rate
+        if rate is not None:
+            now = self._clock()
+            tokens = min(self._burst, bucket.tokens + (now - bucket.last) * rate)
+            bucket.last = now
+            if tokens < 1:
+                bucket.tokens = tokens
+                bucket.suppressed += 1
+                return None
+            bucket.tokens = tokens - 1
+        suppressed = bucket.suppressed
+        bucket.suppressed = 0
+        return suppressed
+
+    def flush(self) -> None:
+        """Log summaries for all keys with suppressed messages."""
+        for key, bucket in self._buckets.items():
+            if bucket.suppressed:
+                log_suppressed(key, bucket.suppressed)
+                bucket.suppressed = 0
+
+    async def setup(self, app: web.Application, interval: float = 60.0) -> None:
+        """Flush summaries every *interval* seconds while *app* runs."""
+        if interval <= 0:
+            raise ValueError(f"interval should be positive, got {interval!r}")
+
+        async def ctx(app: web.Application) -> AsyncIterator[None]:
+            task = asyncio.create_task(self._flush_periodically(interval))
+            try:
+                yield
+            finally:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+                self.flush()
+
+        app.cleanup_ctx.append(ctx)
+
+    async def _flush_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+
+def log_suppressed(key: str, count: int, **extra: object) -> None:
+    msg = "%(count)s %(error)s messages suppressed"
+    context = {"count": count, "error": key}
+    logger.error(msg, context, extra=dict(context, **extra))
+
+
+# shared by all RemoteError subclasses, keyed by class name, does not
+# limit anything until configured
+error_log_limiter = LogLimiter()
+
+
+class _BoundedQueueHandler(QueueHandler):
+    def __init__(self, q: "queue.Queue[logging.LogRecord]", drop: str) -> None:
+        super().__init__(q)
+        self._queue = q
+        self._drop_oldest = drop == "oldest"
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        queue_ = self._queue
+        try:
+            queue_.put_nowait(record)
+            return
+        except queue.Full:
+            self.dropped += 1
+            if not self._drop_oldest:
+                return
+        try:
+            queue_.get_nowait()
+        except queue.Empty:  # pragma: no cover
+            pass
+        try:
+            queue_.put_nowait(record)
+        except queue.Full:  # pragma: no cover
+            self.dropped += 1
+
+
+class _QueueListener(QueueListener):
+    def __init__(
+        self, q: "queue.Queue[logging.LogRecord]", *handlers: logging.Handler
+    ) -> None:
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self._queue = q
+
+    def enqueue_sentinel(self) -> None:
+        # the queue may be full, wait for the thread to make room
+        self._queue.put(self._sentinel)  # type: ignore[attr-defined]
+
+
+class QueueLogging:
+    """Emit records of ``aiohttp_remotes`` logger from a background thread.
+
+    Records are put into a queue of *maxsize* records without blocking,
+    if the queue is full either the new record (*drop* ``"newest"``) or
+    the oldest queued one (*drop* ``"oldest"``) is dropped.  Records are
+    emitted by *handlers*, by default the handlers of the logger or the
+    root logger handlers if the logger has none.
+    """
+
+    def __init__(
+        self,
+        handlers: Iterable[logging.Handler] = (),
+        *,
+        maxsize: int = 10000,
+        drop: str = "newest",
+    ) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"maxsize should be positive, got {maxsize!r}")
+        if drop not in ("newest", "oldest"):
+            raise ValueError(f"drop should be 'newest' or 'oldest', got {drop!r}")
+        self._handlers = list(handlers)
+        self._maxsize = maxsize
+        self._drop = drop
+        self._dropped = 0
+        self._handler: Optional[_BoundedQueueHandler] = None
+        self._listener: Optional[_QueueListener] = None
+        self._saved: List[logging.Handler] = []
+        self._propagate = True
+
+    @property
+    def dropped(self) -> int:
+        """Number of dropped records."""
+        handler = self._handler
+        return self._dropped + (handler.dropped if handler is not None else 0)
+
+    @property
+    def running(self) -> bool:
+        return self._listener is not None
+
+    async def setup(self, app: web.Application) -> None:
+        app.cleanup_ctx.append(self._ctx)
+
+    async def _ctx(self, app: web.Application) -> AsyncIterator[None]:
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def start(self) -> None:
+        if self._listener is not None:
+            raise RuntimeError("Queue logging is already started")
+        handlers = self._handlers or logger.handlers or logging.getLogger().handlers
+        self._saved = list(logger.handlers)
+        self._propagate = logger.propagate
+        q: "queue.Queue[logging.LogRecord]" = queue.Queue(self._maxsize)
+        self._handler = _BoundedQueueHandler(q, self._drop)
+        self._listener = _QueueListener(q, *handlers)
+        self._listener.start()
+        for handler in self._saved:
+            logger.removeHandler(handler)
+        logger.addHandler(self._handler)
+        logger.propagate = False
+
+    def stop(self) -> None:
+        """Restore the logger handlers and emit queued records."""
+        listener = self._listener
+        handler = self._handler
+        if listener is None or handler is None:
+            return
+        logger.removeHandler(handler)
+        for saved in self._saved:
+            logger.addHandler(saved)
+        logger.propagate = self._propagate
+        listener.stop()
+        self._dropped += handler.dropped
+        self._listener = None
+        self._handler = None
+        self._saved = []
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+from typing import Callable, Dict, List
+
+PBKDF2 = "pbkdf2_sha256"
+SCRYPT = "scrypt"
+
+PBKDF2_ITERATIONS = 600_000
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4), validate=True)
+
+
+def _pbkdf2(password: bytes, salt: bytes, params: List[int]) -> bytes:
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac("sha256", password, salt, iterations)
+
+
+# Limit of C int used by hashlib for iterations and maxmem
+_INT_MAX = 2**31 - 1
+
+
+def _scrypt_maxmem(n: int, r: int) -> int:
+    return 256 * n * r + (1 << 20)
+
+
+def _scrypt(password: bytes, salt: bytes, params: List[int]) -> bytes:
+    n, r, p = params
+    return hashlib.scrypt(
+        password, salt=salt, n=n, r=r, p=p, maxmem=_scrypt_maxmem(n, r)
+    )
+
+
+def _check_params(method: str, params: List[int]) -> bool:
+    # Parameters accepted by hashlib, hashes with other ones would raise
+    # on every verification
+    if min(params) <= 0:
+        return False
+    if method == PBKDF2:
+        return params[0] <= _INT_MAX
+    n, r, p = params
+    maxmem = _scrypt_maxmem(n, r)
+    return (
+        n > 1
+        and n & (n - 1) == 0
+        and n.bit_length() - 1 < 16 * r
+        and maxmem < _INT_MAX
+        and 128 * r * (n + p + 2) <= maxmem
+    )
+
+
+_METHODS: Dict[str, Callable[[bytes, bytes, List[int]], bytes]] = {
+    PBKDF2: _pbkdf2,
+    SCRYPT: _scrypt,
+}
+
+
+def hash_password(password: str, method: str = PBKDF2) -> str:
+    """Hash *password* with a random salt.
+
+    The result is ``"pbkdf2_sha256$<iterations>$<salt>$<hash>"`` or
+    ``"scrypt$<n>$<r>$<p>$<salt>$<hash>"`` with base64 encoded salt and
+    hash.
+    """
+    if method == PBKDF2:
+        params = [PBKDF2_ITERATIONS]
+    elif method == SCRYPT:
+        params = [SCRYPT_N, SCRYPT_R, SCRYPT_P]
+    else:
+        raise ValueError(f"Unknown hash method {method!r}")
+    salt = os.urandom(16)
+    digest = _METHODS[method](password.encode("utf-8"), salt, params)
+    fields = [method, *map(str, params), _b64encode(salt), _b64encode(digest)]
+    return "$".join(fields)
+
+
+def check_hash(encoded: str) -> None:
+    """Raise ValueError if *encoded* is not a valid password hash."""
+    method, *fields = encoded.split("$")
+    if method not in _METHODS:
+        raise ValueError(f"Unknown hash method {method!r}")
+    nparams = 1 if method == PBKDF2 else 3
+    if len(fields) != nparams + 2:
+        raise ValueError(f"Invalid {method} hash")
+    try:
+        params = [int(field) for field in fields[:nparams]]
+        salt = _b64decode(fields[-2])
+        digest = _b64decode(fields[-1])
+    except (ValueError, binascii.Error):
+        raise ValueError(f"Invalid {method} hash")
+    if not salt or not digest or not _check_params(method, params):
+        raise ValueError(f"Invalid {method} hash")
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Check *password* against *encoded* hash in constant time.
+
+    The hash should be validated by :func:`check_hash` beforehand.
+    """
+    method, *fields = encoded.split("$")
+    params = [int(field) for field in fields[:-2]]
+    salt = _b64decode(fields[-2])
+    expected = _b64decode(fields[-1])
+    digest = _METHODS[method](password.encode("utf-8"), salt, params)
+    return hmac.compare_digest(digest, expected)
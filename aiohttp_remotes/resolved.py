@@ -0,0 +1,91 @@
+from typing import Dict, Optional
+
+from yarl import URL
+
+from aiohttp import web
+
+Overrides = Dict[str, str]
+
+RESOLVED_KEY = "aiohttp_remotes.overrides"
+
+_EMPTY: Overrides = {}
+
+
+class Resolved:
+    """Remote side information of a request with stored overrides applied.
+
+    Values are read lazily, attributes which are not overridden are taken
+    from the request itself.
+    """
+
+    __slots__ = ("_request", "_overrides")
+
+    def __init__(self, request: web.BaseRequest, overrides: Overrides) -> None:
+        self._request = request
+        self._overrides = overrides
+
+    @property
+    def remote(self) -> Optional[str]:
+        value = self._overrides.get("remote")
+        return self._request.remote if value is None else value
+
+    @property
+    def scheme(self) -> str:
+        value = self._overrides.get("scheme")
+        return self._request.scheme if value is None else value
+
+    @property
+    def host(self) -> str:
+        value = self._overrides.get("host")
+        return self._request.host if value is None else value
+
+    @property
+    def secure(self) -> bool:
+        return self.scheme == "https"
+
+    @property
+    def url(self) -> URL:
+        overrides = self._overrides
+        if "scheme" not in overrides and "host" not in overrides:
+            return self._request.url
+        return URL.build(scheme=self.scheme, authority=self.host).join(
+            self._request.rel_url
+        )
+
+
+def _stored(request: web.BaseRequest) -> Optional[Overrides]:
+    # Mapping.get() and "in" of the request raise and catch KeyError for
+    # a missing key, which is the common case
+    return request._state.get(RESOLVED_KEY)
+
+
+def has_overrides(request: web.BaseRequest) -> bool:
+    """Return True if overrides are stored in *request*.
+
+    Without them resolved() gives the request attributes, tools check
+    this first to read them directly on the fast path.
+    """
+    return RESOLVED_KEY in request._state
+
+
+def resolved(request: web.BaseRequest) -> Resolved:
+    stored = _stored(request)
+    return Resolved(request, _EMPTY if stored is None else stored)
+
+
+def apply_overrides(
+    request: web.Request, overrides: Overrides, clone: bool = True
+) -> web.Request:
+    stored = _stored(request)
+    if clone:
+        request = request.clone(**overrides)  # type: ignore[arg-type]
+        if stored:
+            # values set by clone() take precedence over stored ones
+            request[RESOLVED_KEY] = {
+                key: value for key, value in stored.items() if key not in overrides
+            }
+    elif stored:
+        request[RESOLVED_KEY] = {**stored, **overrides}
+    else:
+        request[RESOLVED_KEY] = dict(overrides)
+    return request
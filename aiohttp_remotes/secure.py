@@ -1,4 +1,4 @@
-from typing import Awaitable, Callable, Iterable, Optional, Union
+from typing import Iterable, Optional, Union
 
 from yarl import URL
 
@@ -6,6 +6,7 @@ from aiohttp import web
 
 from .abc import ABC
 from .log import logger
+from .resolved import Overrides, Resolved, has_overrides, resolved
 
 
 @web.middleware
@@ -41,9 +42,8 @@ class Secure(ABC):
         self._xss = xss
         self._white_paths = set(white_paths)
 
-    async def setup(self, app: web.Application) -> None:
+    async def prepare(self, app: web.Application) -> None:
         app.on_response_prepare.append(self.on_response_prepare)
-        app.middlewares.append(self.middleware)
 
     async def on_response_prepare(
         self, request: web.Request, response: web.StreamResponse
@@ -61,23 +61,23 @@ class Secure(ABC):
         if xss is not None:
             response.headers.setdefault("X-XSS-Protection", xss)
 
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
-        whitepath = request.path in self._white_paths
-        if not whitepath and not request.secure:
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        if request.path in self._white_paths:
+            return None
+
+        info: Union[Resolved, web.Request]
+        info = resolved(request) if has_overrides(request) else request
+        if not info.secure:
+            request_url = info.url
             if self._redirect:
                 if self._redirect_url:
-                    url = self._redirect_url.join(request.url.relative())
+                    url = self._redirect_url.join(request_url.relative())
                 else:
-                    url = request.url.with_scheme("https").with_port(None)
+                    url = request_url.with_scheme("https").with_port(None)
                 raise web.HTTPPermanentRedirect(url)
             else:
                 msg = "Not secure URL %(url)s"
-                logger.error(msg, {"url": request.url})
+                logger.error(msg, {"url": request_url})
                 return await self.raise_error(request)
 
-        return await handler(request)
+        return None
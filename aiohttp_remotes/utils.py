@@ -1,4 +1,5 @@
 import builtins
+from bisect import bisect_right
 from ipaddress import (
     IPv4Address,
     IPv4Network,
@@ -7,13 +8,30 @@ from ipaddress import (
     ip_address,
     ip_network,
 )
-from typing import Iterable, List, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from weakref import WeakKeyDictionary
+
+from typing_extensions import NoReturn
 
+from .cache import LRUCache
 from .exceptions import (
+    HeaderTooLarge,
     IncorrectIPCount,
     IPAddress,
     IPNetwork,
     IPRule,
+    TooManyElements,
     Trusted,
     UntrustedIP,
 )
@@ -26,9 +44,73 @@ MSG = "Trusted list should be a sequence of sets " "with either addresses or net
 
 IP_CLASSES = (IPv4Address, IPv6Address, IPv4Network, IPv6Network)
 
+Ranges = Tuple[List[int], List[int]]
+
+# (trust level, IP) -> verdict
+VerdictCache = LRUCache[Tuple[int, IPAddress], bool]
+
+_Cache = TypeVar("_Cache", bound="LRUCache[Any, Any]")
+
+
+def _compile_ranges(ranges: List[Tuple[int, int]]) -> Ranges:
+    starts: List[int] = []
+    ends: List[int] = []
+    for start, end in sorted(ranges):
+        if ends and start <= ends[-1] + 1:
+            # overlapping or adjacent, extend the previous range
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+class TrustedElement(List[IPRule]):
+    """A trust level: addresses and networks compiled into a lookup index.
+
+    The list keeps the original rules, lookups are performed by bisecting
+    sorted and merged integer ranges, separate for IPv4 and IPv6.  The
+    index is built once, mutating methods raise TypeError.
+    """
+
+    def __init__(self, rules: Iterable[IPRule] = ()) -> None:
+        super().__init__(rules)
+        v4: List[Tuple[int, int]] = []
+        v6: List[Tuple[int, int]] = []
+        for rule in self:
+            if isinstance(rule, (IPv4Address, IPv6Address)):
+                start = end = int(rule)
+            else:
+                start = int(rule.network_address)
+                end = int(rule.broadcast_address)
+            if rule.version == 4:
+                v4.append((start, end))
+            else:
+                v6.append((start, end))
+        self._v4 = _compile_ranges(v4)
+        self._v6 = _compile_ranges(v6)
+
+    def contains_ip(self, ip: IPAddress) -> bool:
+        starts, ends = self._v4 if ip.version == 4 else self._v6
+        num = int(ip)
+        pos = bisect_right(starts, num) - 1
+        return pos >= 0 and num <= ends[pos]
+
+    def _read_only(self, *args: Any, **kwargs: Any) -> NoReturn:
+        raise TypeError(f"{type(self).__name__} is read-only")
+
+    append = extend = insert = remove = pop = clear = _read_only
+    sort = reverse = __setitem__ = __delitem__ = _read_only
+    __iadd__ = __imul__ = _read_only
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # copy and pickle fill a list subclass by extend()
+        return (type(self), (list(self),))
 
-def parse_trusted_element(elem: Elem) -> List[Union[IPAddress, IPNetwork]]:
-    new_elem = []
+
+def parse_trusted_element(elem: Elem) -> TrustedElement:
+    new_elem: List[IPRule] = []
     for item in elem:
         if isinstance(item, IP_CLASSES):
             new_elem.append(item)
@@ -40,7 +122,7 @@ def parse_trusted_element(elem: Elem) -> List[Union[IPAddress, IPNetwork]]:
                 new_elem.append(ip_network(item))
             except ValueError:
                 raise ValueError(f"{item!r} is not IPv4 or IPv6 address or network")
-    return new_elem
+    return TrustedElement(new_elem)
 
 
 def parse_trusted_list(lst: TrustedOrig) -> Trusted:
@@ -63,26 +145,220 @@ def parse_trusted_list(lst: TrustedOrig) -> Trusted:
     return out
 
 
-def remote_ip(trusted: Trusted, ips: Sequence[IPAddress]) -> IPAddress:
+def count_elements(values: Sequence[str]) -> int:
+    """Count elements of raw header values by commas, without tokenizing."""
+    return sum(value.count(",") + 1 for value in values)
+
+
+class HeaderLimits:
+    """Upper bounds for forwarding headers.
+
+    Limits are checked on raw header values before any tokenizing,
+    elements are counted by commas.  Every rejection is counted.
+    """
+
+    def __init__(
+        self, max_header_size: Optional[int] = None, max_elements: Optional[int] = None
+    ) -> None:
+        if max_header_size is not None and max_header_size <= 0:
+            raise ValueError(
+                f"max_header_size should be positive, got {max_header_size!r}"
+            )
+        if max_elements is not None and max_elements <= 0:
+            raise ValueError(f"max_elements should be positive, got {max_elements!r}")
+        self._max_header_size = max_header_size
+        self._max_elements = max_elements
+        self.headers_too_large = 0
+        self.too_many_elements = 0
+
+    @property
+    def max_header_size(self) -> Optional[int]:
+        return self._max_header_size
+
+    @property
+    def max_elements(self) -> Optional[int]:
+        return self._max_elements
+
+    def check(self, name: str, values: Sequence[str]) -> None:
+        max_header_size = self._max_header_size
+        if max_header_size is not None:
+            size = sum(map(len, values))
+            if size > max_header_size:
+                self.headers_too_large += 1
+                raise HeaderTooLarge(name, size, max_header_size)
+        max_elements = self._max_elements
+        if max_elements is not None:
+            count = count_elements(values)
+            if count > max_elements:
+                self.too_many_elements += 1
+                raise TooManyElements(name, count, max_elements)
+
+
+class HeaderParsing(Generic[_Cache]):
+    """Mixin of tools which parse forwarding headers.
+
+    Holds the limits checked on raw values and the optional cache of
+    parsed values.
+    """
+
+    _header_cache: Optional[_Cache]
+    _header_limits: HeaderLimits
+
+    def _setup_headers(
+        self,
+        cache_type: Callable[[int, int], _Cache],
+        header_cache_size: int,
+        header_cache_bytes: int,
+        max_header_size: Optional[int],
+        max_elements: Optional[int],
+    ) -> None:
+        self._header_cache = (
+            cache_type(header_cache_size, header_cache_bytes)
+            if header_cache_size
+            else None
+        )
+        self._header_limits = HeaderLimits(max_header_size, max_elements)
+
+    @property
+    def header_cache(self) -> Optional[_Cache]:
+        return self._header_cache
+
+    @property
+    def header_limits(self) -> HeaderLimits:
+        return self._header_limits
+
+
+class VerdictCaching:
+    """Mixin of tools which check addresses against trusted networks."""
+
+    _verdict_cache: Optional[VerdictCache]
+
+    def _setup_verdict_cache(self, verdict_cache_size: int) -> None:
+        self._verdict_cache = (
+            VerdictCache(verdict_cache_size) if verdict_cache_size else None
+        )
+
+    @property
+    def verdict_cache(self) -> Optional[VerdictCache]:
+        return self._verdict_cache
+
+
+class PeerCache:
+    """Parsed peer address and its first hop verdict per connection.
+
+    Entries are keyed by transport and held weakly, so an entry goes away
+    together with its connection.  Keep-alive requests on the same
+    connection skip both ``peername`` parsing and the first level check.
+    """
+
+    def __init__(self, trusted: Trusted) -> None:
+        self._trusted = trusted
+        self._peers: "WeakKeyDictionary[Any, Tuple[IPAddress, Optional[bool]]]" = (
+            WeakKeyDictionary()
+        )
+
+    def __len__(self) -> int:
+        return len(self._peers)
+
+    def get(self, transport: Any) -> Tuple[IPAddress, Optional[bool]]:
+        """Return the peer address and whether it passes the first level.
+
+        The verdict is ``None`` when the first level trusts everything.
+        """
+        try:
+            return self._peers[transport]
+        except (KeyError, TypeError):
+            pass
+        peer_ip, *_ = transport.get_extra_info("peername")
+        ip = ip_address(peer_ip)
+        verdict: Optional[bool] = None
+        if self._trusted and self._trusted[0] is not ...:
+            verdict = _match_ip(self._trusted[0], ip)
+        entry = (ip, verdict)
+        if not transport.is_closing():
+            try:
+                self._peers[transport] = entry
+            except TypeError:
+                # transport does not support weak references
+                pass
+        return entry
+
+
+def remote_ip(
+    trusted: Trusted,
+    ips: Sequence[IPAddress],
+    cache: Optional[VerdictCache] = None,
+    first: Optional[bool] = None,
+) -> IPAddress:
     if len(trusted) + 1 != len(ips):
         raise IncorrectIPCount(len(trusted) + 1, ips)
-    for i in range(len(trusted)):
-        ip = ips[i]
-        tr = trusted[i]
+    level = untrusted_level(trusted, ips, cache, first)
+    if level >= 0:
+        raise UntrustedIP(ips[level], trusted[level])
+    for i, tr in enumerate(trusted):
         if tr is ...:
-            return ip
-        # cast drops previously handled ... type
-        check_ip(tr, ip)
+            return ips[i]
     return ips[-1]
 
 
-def check_ip(trusted: Sequence[IPRule], ip: IPAddress) -> None:
+def untrusted_level(
+    trusted: Trusted,
+    ips: Sequence[IPAddress],
+    cache: Optional[VerdictCache] = None,
+    first: Optional[bool] = None,
+) -> int:
+    """Return the first trust level not matching its address or -1.
+
+    ``ips[i]`` is checked against ``trusted[i]``, the check stops at
+    ``...`` level.  *first* is a known verdict for ``ips[0]``.
+    """
+    for i, tr in enumerate(trusted):
+        if tr is ...:
+            break
+        if i == 0 and first is not None:
+            verdict = first
+        else:
+            verdict = is_trusted(tr, ips[i], cache, i)
+        if not verdict:
+            return i
+    return -1
+
+
+def check_ip(
+    trusted: Sequence[IPRule],
+    ip: IPAddress,
+    cache: Optional[VerdictCache] = None,
+    level: int = 0,
+) -> None:
+    if not is_trusted(trusted, ip, cache, level):
+        raise UntrustedIP(ip, trusted)
+
+
+def is_trusted(
+    trusted: Sequence[IPRule],
+    ip: IPAddress,
+    cache: Optional[VerdictCache] = None,
+    level: int = 0,
+) -> bool:
+    """Non-raising counterpart of :func:`check_ip`."""
+    if cache is None:
+        return _match_ip(trusted, ip)
+    key = (level, ip)
+    verdict = cache.get(key)
+    if verdict is None:
+        verdict = _match_ip(trusted, ip)
+        cache.set(key, verdict)
+    return verdict
+
+
+def _match_ip(trusted: Sequence[IPRule], ip: IPAddress) -> bool:
+    if isinstance(trusted, TrustedElement):
+        return trusted.contains_ip(ip)
     for elem in trusted:
         if isinstance(elem, (IPv4Address, IPv6Address)):
             if elem == ip:
-                break
+                return True
         else:
             if ip in elem:
-                break
-    else:
-        raise UntrustedIP(ip, trusted)
+                return True
+    return False
@@ -1,197 +1,299 @@
-from abc import abstractmethod
 from collections.abc import Container
 from ipaddress import ip_address
-from typing import Awaitable, Callable, Iterable, List
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
 
 from multidict import MultiMapping
 
 from aiohttp import hdrs, web
 
 from .abc import ABC
+from .cache import LRUCache
 from .exceptions import (
     IncorrectHostCount,
     IncorrectProtoCount,
     IPAddress,
     RemoteError,
     TooManyHeaders,
-    UntrustedIP,
 )
+from .resolved import Overrides
 from .utils import (
     Elem,
+    HeaderParsing,
+    PeerCache,
     TrustedOrig,
-    check_ip,
+    VerdictCaching,
+    is_trusted,
     parse_trusted_element,
     parse_trusted_list,
     remote_ip,
 )
 
+# (header name, raw value) -> parsed elements, INVALID for invalid values
+HeaderCache = LRUCache[Tuple[str, str], Tuple[Any, ...]]
+INVALID: Tuple[Any, ...] = ()
 
-class XForwardedBase(ABC):
-    async def setup(self, app: web.Application) -> None:
-        app.middlewares.append(self.middleware)
+FORWARDED_HEADERS = frozenset(
+    {hdrs.X_FORWARDED_FOR, hdrs.X_FORWARDED_PROTO, hdrs.X_FORWARDED_HOST}
+)
+
+
+def _parse_ips(value: str) -> Tuple[IPAddress, ...]:
+    return tuple(ip_address(a.strip()) for a in value.split(","))
+
+
+def _parse_strs(value: str) -> Tuple[str, ...]:
+    return tuple(p.strip() for p in value.split(","))
+
+
+def _iter_ips_from_end(value: str) -> Iterator[IPAddress]:
+    end = len(value)
+    while end >= 0:
+        start = value.rfind(",", 0, end)
+        try:
+            yield ip_address(value[start + 1 : end].strip())
+        except ValueError:
+            raise web.HTTPBadRequest(reason=f"Invalid {hdrs.X_FORWARDED_FOR} header")
+        end = start
+
+
+def _nth_from_end(value: str, num: int) -> str:
+    # Split off the last num elements only, long headers are not tokenized
+    parts = value.rsplit(",", num) if num > 0 else value.split(",")
+    try:
+        return parts[-num].strip()
+    except IndexError:
+        raise ValueError(f"Expected at least {num} elements, got {value!r}")
 
-    @web.middleware
-    @abstractmethod
-    async def middleware(
+
+class XForwardedBase(ABC, HeaderParsing[HeaderCache]):
+    _reads_overrides = False
+
+    def has_forwarded(self, headers: MultiMapping[str]) -> bool:
+        """Check in a single pass if any X-Forwarded-* header is present."""
+        return not headers.keys().isdisjoint(FORWARDED_HEADERS)
+
+    def _get_header(
         self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
-        pass
+        headers: MultiMapping[str],
+        name: str,
+        parse: Callable[[str], Tuple[Any, ...]],
+    ) -> Tuple[Any, ...]:
+        values: List[str] = headers.getall(name, [])
+        if not values:
+            return ()
+        if len(values) > 1:
+            raise TooManyHeaders(name)
+        self._header_limits.check(name, values)
+        value = values[0]
+        cache = self._header_cache
+        if cache is None:
+            try:
+                return parse(value)
+            except ValueError:
+                raise web.HTTPBadRequest(reason=f"Invalid {name} header")
+        key = (name, value)
+        parsed = cache.get(key)
+        if parsed is None:
+            try:
+                parsed = parse(value)
+            except ValueError:
+                parsed = INVALID
+            cache.set(key, parsed, len(value))
+        if parsed is INVALID:
+            raise web.HTTPBadRequest(reason=f"Invalid {name} header")
+        return parsed
 
     def get_forwarded_for(self, headers: MultiMapping[str]) -> List[IPAddress]:
-        forwarded_for: List[str] = headers.getall(hdrs.X_FORWARDED_FOR, [])
-        if not forwarded_for:
-            return []
-        if len(forwarded_for) > 1:
+        return list(self._get_header(headers, hdrs.X_FORWARDED_FOR, _parse_ips))
+
+    def iter_forwarded_for(self, headers: MultiMapping[str]) -> Iterator[IPAddress]:
+        """Iterate X-Forwarded-For addresses from right to left.
+
+        Addresses are parsed one by one while iterating unless the header
+        cache is enabled, the caller can stop early.
+        """
+        if self._header_cache is not None:
+            ips: Tuple[IPAddress, ...] = self._get_header(
+                headers, hdrs.X_FORWARDED_FOR, _parse_ips
+            )
+            return reversed(ips)
+        values: List[str] = headers.getall(hdrs.X_FORWARDED_FOR, [])
+        if not values:
+            return iter(())
+        if len(values) > 1:
             raise TooManyHeaders(hdrs.X_FORWARDED_FOR)
-        forwarded_for = forwarded_for[0].split(",")
-        valid_ips = []
-        for a in forwarded_for:
-            addr = a.strip()
-            try:
-                valid_ips.append(ip_address(addr))
-            except ValueError:
-                raise web.HTTPBadRequest(
-                    reason=f"Invalid {hdrs.X_FORWARDED_FOR} header"
-                )
-        return valid_ips
+        self._header_limits.check(hdrs.X_FORWARDED_FOR, values)
+        return _iter_ips_from_end(values[0])
 
     def get_forwarded_proto(self, headers: MultiMapping[str]) -> List[str]:
-        forwarded_proto: List[str] = headers.getall(hdrs.X_FORWARDED_PROTO, [])
-        if not forwarded_proto:
-            return []
-        if len(forwarded_proto) > 1:
-            raise TooManyHeaders(hdrs.X_FORWARDED_PROTO)
-        forwarded_proto = forwarded_proto[0].split(",")
-        return [p.strip() for p in forwarded_proto]
+        return list(self._get_header(headers, hdrs.X_FORWARDED_PROTO, _parse_strs))
 
     def get_forwarded_host(self, headers: MultiMapping[str]) -> List[str]:
-        forwarded_host: List[str] = headers.getall(hdrs.X_FORWARDED_HOST, [])
-        if not forwarded_host:
-            return []
-        if len(forwarded_host) > 1:
-            raise TooManyHeaders(hdrs.X_FORWARDED_HOST)
-        forwarded_host = forwarded_host[0].split(",")
-        return [p.strip() for p in forwarded_host]
+        return list(self._get_header(headers, hdrs.X_FORWARDED_HOST, _parse_strs))
 
 
 class XForwardedRelaxed(XForwardedBase):
-    def __init__(self, num: int = 1) -> None:
-        self._num = num
-
-    @web.middleware
-    async def middleware(
+    def __init__(
         self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
+        num: int = 1,
+        *,
+        clone: bool = True,
+        header_cache_size: int = 0,
+        header_cache_bytes: int = 1 << 20,
+        max_header_size: Optional[int] = None,
+        max_elements: Optional[int] = None,
+    ) -> None:
+        self._num = num
+        self._clone = clone
+        self._setup_headers(
+            HeaderCache,
+            header_cache_size,
+            header_cache_bytes,
+            max_header_size,
+            max_elements,
+        )
+
+    def _parse_ip(self, value: str) -> Tuple[IPAddress]:
+        return (ip_address(_nth_from_end(value, self._num)),)
+
+    def _parse_str(self, value: str) -> Tuple[str]:
+        return (_nth_from_end(value, self._num),)
+
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        headers = request.headers
+        if not self.has_forwarded(headers):
+            return None
         try:
             overrides = {}
-            headers = request.headers
 
-            forwarded_for = self.get_forwarded_for(headers)
+            # Only the num-th element from the end is parsed
+            forwarded_for = self._get_header(
+                headers, hdrs.X_FORWARDED_FOR, self._parse_ip
+            )
             if forwarded_for:
-                overrides["remote"] = str(forwarded_for[-self._num])
+                overrides["remote"] = str(forwarded_for[0])
 
-            proto = self.get_forwarded_proto(headers)
+            proto = self._get_header(headers, hdrs.X_FORWARDED_PROTO, self._parse_str)
             if proto:
-                overrides["scheme"] = proto[-self._num]
+                overrides["scheme"] = proto[0]
 
-            host = self.get_forwarded_host(headers)
+            host = self._get_header(headers, hdrs.X_FORWARDED_HOST, self._parse_str)
             if host:
-                overrides["host"] = str(host[-self._num])
-
-            request = request.clone(**overrides)  # type: ignore[arg-type]
+                overrides["host"] = host[0]
 
-            return await handler(request)
+            return overrides
         except RemoteError as exc:
-            exc.log(request)
-            return await self.raise_error(request)
+            return await self.reject(request, exc)
 
 
-class XForwardedFiltered(XForwardedBase):
-    def __init__(self, trusted: Elem) -> None:
+class XForwardedFiltered(XForwardedBase, VerdictCaching):
+    def __init__(
+        self,
+        trusted: Elem,
+        *,
+        verdict_cache_size: int = 0,
+        clone: bool = True,
+        header_cache_size: int = 0,
+        header_cache_bytes: int = 1 << 20,
+        max_header_size: Optional[int] = None,
+        max_elements: Optional[int] = None,
+    ) -> None:
         if isinstance(trusted, str) or not isinstance(trusted, Container):
             raise TypeError("Trusted list should be a set of aaddresses or networks.")
         self._trusted = parse_trusted_element(trusted)
-
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
+        self._clone = clone
+        self._setup_headers(
+            HeaderCache,
+            header_cache_size,
+            header_cache_bytes,
+            max_header_size,
+            max_elements,
+        )
+        self._setup_verdict_cache(verdict_cache_size)
+
+    async def process(self, request: web.Request) -> Optional[Overrides]:
+        headers = request.headers
+        if not self.has_forwarded(headers):
+            return None
         try:
             overrides = {}
-            headers = request.headers
-
-            forwarded_for = list(reversed(self.get_forwarded_for(headers)))
-            if not forwarded_for:
-                return await handler(request)
 
+            trusted = self._trusted
+            cache = self._verdict_cache
             index = 0
-            for ip in forwarded_for:
-                try:
-                    check_ip(self._trusted, ip)
-                    index += 1
-                    continue
-                except UntrustedIP:
-                    overrides["remote"] = str(ip)
+            ip: Optional[IPAddress] = None
+            for ip in self.iter_forwarded_for(headers):
+                if not is_trusted(trusted, ip, cache):
                     break
-
-            # If all the IP addresses are from trusted networks, take the
-            # left-most.
-            if "remote" not in overrides:
+                index += 1
+            else:
+                if ip is None:
+                    return None
+                # If all the IP addresses are from trusted networks, take the
+                # left-most.
                 index = -1
-                overrides["remote"] = str(forwarded_for[-1])
+            overrides["remote"] = str(ip)
 
             # Ideally this should take the scheme corresponding to the entry
             # in X-Forwarded-For that was chosen, but some proxies (the
             # Kubernetes NGINX ingress, for example) only retain one element
             # in X-Forwarded-Proto.  In that case, use what we have.
-            proto = list(reversed(self.get_forwarded_proto(headers)))
+            proto = self._get_header(headers, hdrs.X_FORWARDED_PROTO, _parse_strs)
             if proto:
                 if index >= len(proto):
                     index = -1
-                overrides["scheme"] = proto[index]
+                overrides["scheme"] = proto[-1 - index]
 
-            host = list(reversed(self.get_forwarded_host(headers)))
+            host = self._get_header(headers, hdrs.X_FORWARDED_HOST, _parse_strs)
             if host:
                 if index >= len(host):
                     index = -1
-                overrides["host"] = host[index]
+                overrides["host"] = host[-1 - index]
 
-            request = request.clone(**overrides)  # type: ignore[arg-type]
-            return await handler(request)
+            return overrides
 
         except RemoteError as exc:
-            exc.log(request)
-            return await self.raise_error(request)
+            return await self.reject(request, exc)
 
 
-class XForwardedStrict(XForwardedBase):
-    def __init__(self, trusted: TrustedOrig, *, white_paths: Iterable[str] = ()):
+class XForwardedStrict(XForwardedBase, VerdictCaching):
+    def __init__(
+        self,
+        trusted: TrustedOrig,
+        *,
+        white_paths: Iterable[str] = (),
+        verdict_cache_size: int = 0,
+        clone: bool = True,
+        header_cache_size: int = 0,
+        header_cache_bytes: int = 1 << 20,
+        max_header_size: Optional[int] = None,
+        max_elements: Optional[int] = None,
+    ):
         self._trusted = parse_trusted_list(trusted)
         self._white_paths = set(white_paths)
-
-    @web.middleware
-    async def middleware(
-        self,
-        request: web.Request,
-        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
-    ) -> web.StreamResponse:
+        self._clone = clone
+        self._setup_headers(
+            HeaderCache,
+            header_cache_size,
+            header_cache_bytes,
+            max_header_size,
+            max_elements,
+        )
+        self._setup_verdict_cache(verdict_cache_size)
+        self._peer_cache = PeerCache(self._trusted)
+
+    async def process(self, request: web.Request) -> Optional[Overrides]:
         if request.path in self._white_paths:
-            return await handler(request)
+            return None
         try:
             overrides = {}
             headers = request.headers
 
             forwarded_for = self.get_forwarded_for(headers)
             assert request.transport is not None
-            peer_ip, *_ = request.transport.get_extra_info("peername")
-            ips = [ip_address(peer_ip)] + list(reversed(forwarded_for))
-            ip = remote_ip(self._trusted, ips)
+            peer, first = self._peer_cache.get(request.transport)
+            ips = [peer] + list(reversed(forwarded_for))
+            ip = remote_ip(self._trusted, ips, self._verdict_cache, first)
             overrides["remote"] = str(ip)
 
             proto = self.get_forwarded_proto(headers)
@@ -206,10 +308,7 @@ class XForwardedStrict(XForwardedBase):
                     raise IncorrectHostCount(len(self._trusted), host)
                 overrides["host"] = host[0]
 
-            request = request.clone(**overrides)  # type: ignore[arg-type]
-
-            return await handler(request)
+            return overrides
 
         except RemoteError as exc:
-            exc.log(request)
-            return await self.raise_error(request)
+            return await self.reject(request, exc)
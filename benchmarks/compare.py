@@ -0,0 +1,138 @@
+"""Compare benchmark results with a stored baseline.
+
+Run with ``python -m benchmarks.compare baseline.json results.json`` or
+measure and compare at once with
+``python -m benchmarks.run --compare baseline.json``.
+
+Both files are written by ``python -m benchmarks.run --output``.  A
+scenario regresses if its median time grows by more than the threshold.
+The threshold is widened by the noise of both measurements: the spread
+of their runs relative to the median.  The exit code is 1 if any
+scenario regresses.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+Results = Dict[str, Any]
+
+# compared metadata, results from different environments are not comparable
+ENVIRONMENT = ("aiohttp", "python", "implementation", "machine")
+
+
+class Row(NamedTuple):
+    name: str
+    baseline_us: Optional[float]
+    current_us: Optional[float]
+    change: Optional[float]
+    limit: Optional[float]
+    status: str
+
+
+def load(path: str) -> Results:
+    with open(path, encoding="utf-8") as f:
+        data: Results = json.load(f)
+    if "results" not in data:
+        raise SystemExit(f"{path} doesn't contain benchmark results")
+    return data
+
+
+def noise(result: Dict[str, Any]) -> float:
+    """Spread of runs relative to the median."""
+    runs = result["runs_us"]
+    if len(runs) < 2:
+        return 0.0
+    return float((max(runs) - min(runs)) / result["median_us"])
+
+
+def compare(
+    baseline: Results, current: Results, threshold: float, subset: bool = False
+) -> List[Row]:
+    """Compare current results with the baseline scenario by scenario.
+
+    Scenarios missing in current results are reported unless *subset*
+    is set, e.g. when only selected scenarios were measured.
+    """
+    base = baseline["results"]
+    cur = current["results"]
+    rows = []
+    for name in sorted(base.keys() | cur.keys()):
+        if name not in cur:
+            if not subset:
+                rows.append(
+                    Row(name, base[name]["median_us"], None, None, None, "gone")
+                )
+            continue
+        if name not in base:
+            rows.append(Row(name, None, cur[name]["median_us"], None, None, "new"))
+            continue
+        base_us = base[name]["median_us"]
+        cur_us = cur[name]["median_us"]
+        change = cur_us / base_us - 1
+        limit = max(threshold, noise(base[name]) + noise(cur[name]))
+        if change > limit:
+            status = "REGRESSION"
+        elif change < -limit:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append(Row(name, base_us, cur_us, change, limit, status))
+    return rows
+
+
+def _format(value: Optional[float], width: int, fmt: str) -> str:
+    if value is None:
+        return "-".rjust(width)
+    return format(value, fmt).rjust(width)
+
+
+def report(rows: Sequence[Row], baseline: Results, current: Results) -> int:
+    """Print the comparison, return the number of regressions."""
+    base_meta = baseline.get("meta", {})
+    cur_meta = current.get("meta", {})
+    for key in ENVIRONMENT:
+        if base_meta.get(key) != cur_meta.get(key):
+            print(
+                f"warning: {key} differs: {base_meta.get(key)} in baseline, "
+                f"{cur_meta.get(key)} now",
+                file=sys.stderr,
+            )
+    print(
+        f"{'scenario':60} {'baseline':>10} {'current':>10} "
+        f"{'change':>8} {'limit':>7}  status"
+    )
+    regressions = 0
+    for row in rows:
+        if row.status == "REGRESSION":
+            regressions += 1
+        print(
+            f"{row.name:60} {_format(row.baseline_us, 10, '.2f')} "
+            f"{_format(row.current_us, 10, '.2f')} {_format(row.change, 8, '+.1%')} "
+            f"{_format(row.limit, 7, '.1%')}  {row.status}"
+        )
+    print(f"{regressions} regression(s) in {len(rows)} scenario(s)")
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="minimal relative slowdown treated as a regression",
+    )
+    args = parser.parse_args(argv)
+    baseline = load(args.baseline)
+    current = load(args.current)
+    rows = compare(baseline, current, args.threshold)
+    if report(rows, baseline, current):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
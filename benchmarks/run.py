@@ -0,0 +1,515 @@
+"""Benchmark suite for all aiohttp_remotes tools.
+
+Run with ``python -m benchmarks.run``.
+
+Every scenario drives a single tool either by calling its middleware
+directly with prepared requests (``direct`` mode) or by sending real
+requests to the aiohttp test server (``server`` mode).  Scenarios vary
+trusted list sizes, header lengths and hit/miss ratios of caches and
+checks.
+
+``function`` mode measures trust checks and header parsers alone.
+
+Secure scenarios are served over TLS in ``server`` mode, they are
+skipped if ``trustme`` is not installed.
+
+Timings are collected in several runs, the median time per call is
+reported.  ``--output results.json`` writes machine readable results,
+``--compare baseline.json`` reports the change against stored results
+and fails on regressions, see :mod:`benchmarks.compare`.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from functools import partial
+from ipaddress import ip_address
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+from aiohttp_remotes import (
+    AllowedHosts,
+    BasicAuth,
+    Cloudflare,
+    ForwardedRelaxed,
+    ForwardedStrict,
+    Secure,
+    XForwardedFiltered,
+    XForwardedRelaxed,
+    XForwardedStrict,
+    __version__,
+)
+from aiohttp_remotes.abc import ABC
+from aiohttp_remotes.exceptions import UntrustedIP
+from aiohttp_remotes.forwarded import _parse_forwarded
+from aiohttp_remotes.log import logger
+from aiohttp_remotes.utils import (
+    check_ip,
+    parse_trusted_element,
+    parse_trusted_list,
+    remote_ip,
+)
+from aiohttp_remotes.x_forwarded import _nth_from_end, _parse_ips
+
+from .compare import compare, load, report
+
+try:
+    import trustme
+
+    TRUSTME = True
+except ImportError:
+    TRUSTME = False
+
+Headers = Dict[str, str]
+ToolFactory = Callable[[], ABC]
+
+PEER = "127.0.0.1"
+CLIENT = "203.0.113.7"
+POOL_SIZE = 100
+CACHE_SIZE = 8
+RESPONSE = web.Response()
+
+
+class Scenario(NamedTuple):
+    name: str
+    make_tool: ToolFactory
+    # requests are sent round-robin, the pool defines hit/miss ratio
+    pool: Sequence[Headers]
+    secure: bool = False
+
+
+class Function(NamedTuple):
+    name: str
+    call: Callable[[], object]
+
+
+class Transport:
+    """Minimal transport for mocked requests, one per benchmark run."""
+
+    def __init__(self, sslcontext: Optional[ssl.SSLContext] = None) -> None:
+        self._extra = {"peername": (PEER, 54321), "sslcontext": sslcontext}
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return self._extra.get(name, default)
+
+    def is_closing(self) -> bool:
+        return False
+
+
+def networks(count: int) -> List[str]:
+    return [f"10.{i // 256}.{i % 256}.0/24" for i in range(count)]
+
+
+def hops(count: int) -> List[str]:
+    # addresses of proxies from networks(), nearest to the server last
+    return [f"10.{i // 256}.{i % 256}.1" for i in reversed(range(count))]
+
+
+def client(i: int) -> str:
+    return f"198.51.{i // 256 % 256}.{i % 256}"
+
+
+def mix(hot: Headers, cold: Callable[[int], Headers], ratio: float) -> List[Headers]:
+    """Pool with *ratio* share of *hot* requests, the rest are distinct."""
+    hot_count = round(POOL_SIZE * ratio)
+    pool = []
+    for i in range(POOL_SIZE):
+        # spread hot requests evenly among cold ones
+        if (i + 1) * hot_count // POOL_SIZE != i * hot_count // POOL_SIZE:
+            pool.append(hot)
+        else:
+            pool.append(cold(i))
+    return pool
+
+
+def xff(*parts: str) -> Headers:
+    return {
+        "X-Forwarded-For": ", ".join(parts),
+        "X-Forwarded-Proto": "https",
+        "X-Forwarded-Host": "example.com",
+    }
+
+
+def forwarded(*parts: str) -> Headers:
+    elems = [f"for={part}" for part in parts]
+    elems[0] += ";proto=https;host=example.com"
+    return {"Forwarded": ", ".join(elems)}
+
+
+def basic(username: str, password: str) -> Headers:
+    token = b64encode(f"{username}:{password}".encode()).decode()
+    return {"Authorization": f"Basic {token}"}
+
+
+def write_snapshot(path: str, masks: List[str]) -> None:
+    data = {"fetched_at": time.time(), "networks": masks}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def scenarios(tmpdir: str) -> Iterator[Scenario]:
+    plain: Headers = {"Host": "example.com"}
+
+    yield Scenario("x_forwarded_relaxed/no-headers", XForwardedRelaxed, [plain])
+    for length in (1, 10, 100, 500):
+        yield Scenario(
+            f"x_forwarded_relaxed/length-{length}",
+            XForwardedRelaxed,
+            [xff(*[CLIENT] * length)],
+        )
+    # overrides are stored in the request instead of clone()
+    yield Scenario(
+        "x_forwarded_relaxed/length-1/store",
+        lambda: XForwardedRelaxed(clone=False),
+        [xff(CLIENT)],
+    )
+
+    yield Scenario(
+        "x_forwarded_filtered/no-headers",
+        lambda: XForwardedFiltered(networks(10)),
+        [plain],
+    )
+
+    for size in (1, 100, 10000):
+        yield Scenario(
+            f"x_forwarded_filtered/trusted-{size}",
+            lambda size=size: XForwardedFiltered(networks(size)),
+            [xff(CLIENT, *hops(min(size, 10)))],
+        )
+    for length in (10, 100):
+        yield Scenario(
+            f"x_forwarded_filtered/length-{length}",
+            lambda: XForwardedFiltered(networks(10)),
+            [xff(*[CLIENT] * (length - 2), CLIENT, *hops(1))],
+        )
+    for ratio in (0.0, 0.9, 1.0):
+        yield Scenario(
+            f"x_forwarded_filtered/verdict-hit-{ratio:.0%}",
+            lambda: XForwardedFiltered(networks(1000), verdict_cache_size=CACHE_SIZE),
+            mix(xff(CLIENT, *hops(3)), lambda i: xff(client(i), *hops(3)), ratio),
+        )
+
+    for depth in (1, 4):
+        yield Scenario(
+            f"x_forwarded_strict/depth-{depth}",
+            lambda depth=depth: XForwardedStrict(
+                [[PEER]] + [networks(depth)] * (depth - 1)
+            ),
+            [xff(CLIENT, *hops(depth - 1))],
+        )
+    for ratio in (0.0, 0.9):
+        yield Scenario(
+            f"x_forwarded_strict/header-hit-{ratio:.0%}",
+            lambda: XForwardedStrict(
+                [[PEER], networks(4)], header_cache_size=CACHE_SIZE
+            ),
+            mix(xff(CLIENT, *hops(1)), lambda i: xff(client(i), *hops(1)), ratio),
+        )
+
+    for length in (1, 100):
+        yield Scenario(
+            f"forwarded_relaxed/length-{length}",
+            ForwardedRelaxed,
+            [forwarded(*[CLIENT] * length)],
+        )
+    for depth in (1, 4):
+        yield Scenario(
+            f"forwarded_strict/depth-{depth}",
+            lambda depth=depth: ForwardedStrict(
+                [[PEER]] + [networks(depth)] * (depth - 1)
+            ),
+            [forwarded(CLIENT, *hops(depth - 1))],
+        )
+    for ratio in (0.0, 0.9):
+        yield Scenario(
+            f"forwarded_strict/header-hit-{ratio:.0%}",
+            lambda: ForwardedStrict(
+                [[PEER], networks(4)], header_cache_size=CACHE_SIZE
+            ),
+            mix(
+                forwarded(CLIENT, *hops(1)),
+                lambda i: forwarded(client(i), *hops(1)),
+                ratio,
+            ),
+        )
+
+    for size in (20, 1000):
+        for accept in (True, False):
+            snapshot = os.path.join(tmpdir, f"cloudflare-{size}-{accept}.json")
+            # the peer is a Cloudflare address if the request is accepted
+            write_snapshot(snapshot, networks(size - 1) + [PEER if accept else CLIENT])
+            yield Scenario(
+                f"cloudflare/networks-{size}/{'accept' if accept else 'reject'}",
+                lambda snapshot=snapshot: Cloudflare(
+                    snapshot=snapshot, refresh_interval=365 * 24 * 3600
+                ),
+                [{"CF-CONNECTING-IP": CLIENT}],
+            )
+
+    for size in (1, 100):
+        hosts = [f"host{i}.example.com" for i in range(size)]
+        for ratio in (1.0, 0.5):
+            yield Scenario(
+                f"allowed_hosts/hosts-{size}/accept-{ratio:.0%}",
+                lambda hosts=hosts: AllowedHosts(hosts),
+                mix({"Host": hosts[-1]}, lambda i: {"Host": "evil.com"}, ratio),
+            )
+
+    for ratio in (1.0, 0.5):
+        yield Scenario(
+            f"basic_auth/accept-{ratio:.0%}",
+            lambda: BasicAuth("user", "secret", "realm"),
+            mix(basic("user", "secret"), lambda i: basic("user", f"bad{i}"), ratio),
+        )
+
+    yield Scenario("secure/https", Secure, [plain], secure=True)
+    yield Scenario("secure/http-redirect", Secure, [plain])
+
+
+def functions() -> Iterator[Function]:
+    for depth in (1, 4):
+        trusted = parse_trusted_list([[PEER]] + [networks(depth)] * (depth - 1))
+        ips = [ip_address(a) for a in [PEER, *reversed(hops(depth - 1)), CLIENT]]
+        yield Function(
+            f"utils/remote_ip/depth-{depth}",
+            lambda trusted=trusted, ips=ips: remote_ip(trusted, ips),
+        )
+
+    def check(trusted: Any, ip: Any) -> None:
+        try:
+            check_ip(trusted, ip)
+        except UntrustedIP:
+            pass
+
+    for size in (1, 100, 10000):
+        element = parse_trusted_element(networks(size))
+        for verdict, addr in (("hit", hops(size)[0]), ("miss", CLIENT)):
+            yield Function(
+                f"utils/check_ip/trusted-{size}/{verdict}",
+                lambda element=element, ip=ip_address(addr): check(element, ip),
+            )
+
+    for length in (1, 10, 100):
+        value = ", ".join([CLIENT] * length)
+        yield Function(
+            f"x_forwarded/parse_ips/length-{length}",
+            lambda value=value: _parse_ips(value),
+        )
+        yield Function(
+            f"x_forwarded/nth_from_end/length-{length}",
+            lambda value=value: _nth_from_end(value, 1),
+        )
+        headers = [forwarded(*[CLIENT] * length)["Forwarded"]]
+        yield Function(
+            f"forwarded/parse/length-{length}",
+            lambda headers=headers: _parse_forwarded(headers),
+        )
+        yield Function(
+            f"forwarded/parse/length-{length}/limit-2",
+            lambda headers=headers: _parse_forwarded(headers, 2),
+        )
+
+
+async def handler(request: web.Request) -> web.StreamResponse:
+    return RESPONSE
+
+
+async def server_handler(request: web.Request) -> web.StreamResponse:
+    # a response can be sent only once
+    return web.Response()
+
+
+async def measure_direct(scenario: Scenario, number: int) -> float:
+    tool = scenario.make_tool()
+    await tool.prepare(web.Application())
+    sslcontext = ssl.create_default_context() if scenario.secure else None
+    transport = Transport(sslcontext)
+    requests = [
+        make_mocked_request(
+            "GET", "/", headers=headers, transport=transport, sslcontext=sslcontext
+        )
+        for headers in scenario.pool
+    ]
+    middleware = tool.middleware
+    count = len(requests)
+    started = time.perf_counter()
+    for i in range(number):
+        try:
+            await middleware(requests[i % count], handler)
+        except web.HTTPException:
+            pass
+    return (time.perf_counter() - started) / number
+
+
+def tls_contexts() -> Tuple[ssl.SSLContext, ssl.SSLContext]:
+    """Server and client SSL contexts with a certificate for localhost."""
+    ca = trustme.CA()
+    server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ca.issue_server_cert("127.0.0.1").configure_cert(server_ctx)
+    client_ctx = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH)
+    ca.configure_trust(client_ctx)
+    return server_ctx, client_ctx
+
+
+async def measure_server(scenario: Scenario, number: int) -> float:
+    app = web.Application()
+    app.router.add_get("/", server_handler)
+    await scenario.make_tool().setup(app)
+    server = TestServer(app)
+    # default verification for plain HTTP
+    client_ctx: Union[ssl.SSLContext, bool] = True
+    if scenario.secure:
+        server_ctx, client_ctx = tls_contexts()
+        await server.start_server(ssl=server_ctx)
+    async with TestClient(server) as cl:
+        count = len(scenario.pool)
+        started = time.perf_counter()
+        for i in range(number):
+            headers = scenario.pool[i % count]
+            async with cl.get(
+                "/", headers=headers, allow_redirects=False, ssl=client_ctx
+            ) as resp:
+                await resp.read()
+        return (time.perf_counter() - started) / number
+
+
+async def measure_function(function: Function, number: int) -> float:
+    call = function.call
+    started = time.perf_counter()
+    for _ in range(number):
+        call()
+    return (time.perf_counter() - started) / number
+
+
+MODES: Dict[str, Callable[[Scenario, int], Awaitable[float]]] = {
+    "direct": measure_direct,
+    "server": measure_server,
+}
+
+
+def measurements(
+    modes: Sequence[str], tmpdir: str
+) -> Iterator[Tuple[str, str, Callable[[int], Awaitable[float]]]]:
+    if "function" in modes:
+        for function in functions():
+            yield (
+                f"function/{function.name}",
+                "function",
+                partial(measure_function, function),
+            )
+    for scenario in scenarios(tmpdir):
+        for mode in modes:
+            if mode not in MODES:
+                continue
+            if mode == "server" and scenario.secure and not TRUSTME:
+                # no certificate for the TLS server
+                continue
+            yield f"{mode}/{scenario.name}", mode, partial(MODES[mode], scenario)
+
+
+async def run(
+    modes: Sequence[str],
+    numbers: Dict[str, int],
+    repeat: int,
+    select: Optional[str] = None,
+) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, mode, measure in measurements(modes, tmpdir):
+            if select is not None and select not in name:
+                continue
+            number = numbers[mode]
+            # warm up caches and lazy imports
+            await measure(max(number // 10, 1))
+            runs = [await measure(number) for _ in range(repeat)]
+            results[name] = {
+                "mode": mode,
+                "number": number,
+                "runs_us": [t * 1e6 for t in runs],
+                "median_us": statistics.median(runs) * 1e6,
+            }
+            print(f"{name:60} {results[name]['median_us']:10.2f} usec")
+    return results
+
+
+def metadata() -> Dict[str, Any]:
+    return {
+        "aiohttp_remotes": __version__,
+        "aiohttp": aiohttp.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "timestamp": time.time(),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--mode", choices=["function", "direct", "server", "all"], default="all"
+    )
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--server-number", type=int, default=300)
+    parser.add_argument("--function-number", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--select", help="run scenarios containing this substring")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="compare results with this baseline file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="minimal relative slowdown treated as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    # rejections are logged, measure the logging call but don't print
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    # load the baseline first, don't run for nothing if it is missing
+    baseline = load(args.compare) if args.compare else None
+    modes = ["function", *MODES] if args.mode == "all" else [args.mode]
+    numbers = {
+        "function": args.function_number,
+        "direct": args.number,
+        "server": args.server_number,
+    }
+    results = asyncio.run(run(modes, numbers, args.repeat, args.select))
+    data = {"meta": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Results are written to {args.output}", file=sys.stderr)
+    if baseline is not None:
+        rows = compare(baseline, data, args.threshold, subset=True)
+        if report(rows, baseline, data):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,35 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from unittest import mock
+
 import pytest
 
 import aiohttp
 from aiohttp import web
 from aiohttp.pytest_plugin import AiohttpClient
-from aiohttp_remotes import BasicAuth, setup as _setup
+from aiohttp_remotes import (
+    BasicAuth,
+    HashedBasicAuth,
+    XForwardedRelaxed,
+    basic_auth,
+    hash_password,
+    passwords,
+    setup as _setup,
+)
+from aiohttp_remotes.basic_auth import FailureThrottle
+from aiohttp_remotes.passwords import check_hash, verify_password
+
+
+@pytest.fixture
+def users(monkeypatch: pytest.MonkeyPatch) -> Dict[str, str]:
+    # cheap hashes for tests
+    monkeypatch.setattr(passwords, "PBKDF2_ITERATIONS", 1000)
+    monkeypatch.setattr(passwords, "SCRYPT_N", 16)
+    return {
+        "user": hash_password("pass"),
+        "other": hash_password("secret:word", "scrypt"),
+    }
 
 
 @pytest.mark.parametrize("password", ["pass", "pass:pass:"])
@@ -68,3 +94,362 @@ async def test_basic_auth_white_path(aiohttp_client: AiohttpClient) -> None:
     cl = await aiohttp_client(app)
     resp = await cl.get("/")
     assert resp.status == 200
+
+
+async def test_basic_auth_no_decode(
+    aiohttp_client: AiohttpClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    def decode(auth_header: str) -> None:
+        raise AssertionError("decoded")
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, BasicAuth("user", "pass", "realm"))
+    monkeypatch.setattr(basic_auth, "_decode_credentials", decode)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 200
+
+
+async def test_basic_auth_slow_path(
+    aiohttp_client: AiohttpClient, caplog: pytest.LogCaptureFixture
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    caplog.set_level("DEBUG", logger="aiohttp_remotes")
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, BasicAuth("user", "pass", "realm"))
+    cl = await aiohttp_client(app)
+    # base64 with a space differs from the token but has the same credentials
+    resp = await cl.get("/", headers={"Authorization": "Basic dXNlcjpw YXNz"})
+    assert resp.status == 200
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "wrong"))
+    assert resp.status == 401
+    assert "wrong credentials for 'user'" in caplog.text
+    resp = await cl.get("/", headers={"Authorization": "Bearer token"})
+    assert resp.status == 401
+    assert "no Basic Authorization header" in caplog.text
+
+
+@pytest.mark.parametrize("method", ["pbkdf2_sha256", "scrypt"])
+def test_hash_password(users: Dict[str, str], method: str) -> None:
+    encoded = hash_password("pass", method)
+    assert encoded.startswith(method + "$")
+    assert encoded != hash_password("pass", method)
+    check_hash(encoded)
+    assert verify_password("pass", encoded)
+    assert not verify_password("wrong", encoded)
+
+
+def test_hash_password_unknown_method() -> None:
+    with pytest.raises(ValueError):
+        hash_password("pass", "md5")
+
+
+@pytest.mark.parametrize(
+    "encoded",
+    [
+        "md5$abc",
+        "pbkdf2_sha256$1000$c2FsdA",
+        "pbkdf2_sha256$many$c2FsdA$aGFzaA",
+        "pbkdf2_sha256$0$c2FsdA$aGFzaA",
+        "scrypt$16$8$c2FsdA$aGFzaA",
+        "scrypt$16$8$1$c2F*dA$aGFzaA",
+        "pbkdf2_sha256$1000$$aGFzaA",
+        "pbkdf2_sha256$1000$c2FsdA$",
+        "pbkdf2_sha256$2147483648$c2FsdA$aGFzaA",
+        "scrypt$3$8$1$c2FsdA$aGFzaA",
+        "scrypt$1$8$1$c2FsdA$aGFzaA",
+        "scrypt$65536$1$1$c2FsdA$aGFzaA",
+        "scrypt$16384$8$536870912$c2FsdA$aGFzaA",
+        "scrypt$1099511627776$8$1$c2FsdA$aGFzaA",
+    ],
+)
+def test_check_hash_invalid(encoded: str) -> None:
+    with pytest.raises(ValueError):
+        check_hash(encoded)
+
+
+async def test_hashed_basic_auth(
+    aiohttp_client: AiohttpClient, users: Dict[str, str]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    tool = HashedBasicAuth(users, "realm")
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 200
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("other", "secret:word"))
+    assert resp.status == 200
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "secret:word"))
+    assert resp.status == 401
+    assert resp.headers["WWW-Authenticate"] == "Basic realm=realm"
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("unknown", "pass"))
+    assert resp.status == 401
+    resp = await cl.get("/", headers={"Authorization": "Basic nonbase64"})
+    assert resp.status == 401
+    resp = await cl.get("/")
+    assert resp.status == 401
+
+    cache = tool.verified_cache
+    assert cache is not None
+    assert len(cache) == 2
+    assert cache.hits == 0
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 200
+    assert cache.hits == 1
+
+
+async def test_hashed_basic_auth_no_cache(
+    aiohttp_client: AiohttpClient, users: Dict[str, str]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    tool = HashedBasicAuth(users, "realm", cache_size=0, white_paths=["/white"])
+    assert tool.verified_cache is None
+    app = web.Application()
+    app.router.add_get("/", handler)
+    app.router.add_get("/white", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 200
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "wrong"))
+    assert resp.status == 401
+    resp = await cl.get("/white")
+    assert resp.status == 200
+
+
+async def test_hashed_basic_auth_no_users(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, HashedBasicAuth({}, "realm"))
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 401
+
+
+async def test_hashed_basic_auth_broken_hash(
+    aiohttp_client: AiohttpClient,
+    users: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    def broken(password: str, encoded: str) -> bool:
+        raise ValueError("n must be a power of 2")
+
+    monkeypatch.setattr(basic_auth, "verify_password", broken)
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, HashedBasicAuth(users, "realm"))
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 401
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("unknown", "pass"))
+    assert resp.status == 401
+
+
+def test_hashed_basic_auth_invalid_hash() -> None:
+    with pytest.raises(ValueError):
+        HashedBasicAuth({"user": "pass"}, "realm")
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_failure_throttle() -> None:
+    clock = Clock()
+    throttle = FailureThrottle(2, 10, clock=clock)
+    assert throttle.retry_after("a") == 0
+    throttle.failed("a")
+    assert throttle.retry_after("a") == 0
+    clock.now = 4
+    throttle.failed("a")
+    assert throttle.retry_after("a") == 6
+    assert throttle.retry_after("b") == 0
+    assert throttle.throttled == 1
+    clock.now = 10
+    assert throttle.retry_after("a") == 0
+    assert len(throttle) == 0
+    throttle.failed("a")
+    throttle.failed("a")
+    throttle.succeeded("a")
+    assert throttle.retry_after("a") == 0
+
+
+def test_failure_throttle_expired_window() -> None:
+    clock = Clock()
+    throttle = FailureThrottle(2, 10, clock=clock)
+    throttle.failed("a")
+    clock.now = 10
+    throttle.failed("a")
+    assert throttle.retry_after("a") == 0
+
+
+def test_failure_throttle_eviction() -> None:
+    throttle = FailureThrottle(1, maxsize=2)
+    throttle.failed("a")
+    throttle.failed("b")
+    throttle.failed("a")
+    throttle.failed("c")
+    assert len(throttle) == 2
+    assert throttle.evictions == 1
+    assert throttle.retry_after("b") == 0
+    assert throttle.retry_after("a") > 0
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"max_failures": 0},
+        {"max_failures": 1, "window": 0},
+        {"max_failures": 1, "maxsize": 0},
+    ],
+)
+def test_failure_throttle_invalid(kwargs: Dict[str, float]) -> None:
+    with pytest.raises(ValueError):
+        FailureThrottle(**kwargs)  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize("clone", [True, False])
+async def test_basic_auth_throttle(
+    aiohttp_client: AiohttpClient,
+    monkeypatch: pytest.MonkeyPatch,
+    fuse: bool,
+    clone: bool,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    auth = BasicAuth("user", "pass", "realm", max_failures=2)
+    assert auth._reads_overrides
+    throttle = auth.throttle
+    assert throttle is not None
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, XForwardedRelaxed(clone=clone), auth, fuse=fuse)
+    cl = await aiohttp_client(app)
+    bad = aiohttp.BasicAuth("user", "wrong")
+    good = aiohttp.BasicAuth("user", "pass")
+
+    for i in range(2):
+        resp = await cl.get("/", auth=bad, headers={"X-Forwarded-For": "10.0.0.1"})
+        assert resp.status == 401
+
+    verify = auth.verify
+
+    async def no_verify(request: web.Request) -> bool:
+        raise AssertionError("verified")
+
+    monkeypatch.setattr(auth, "verify", no_verify)
+    resp = await cl.get("/", auth=good, headers={"X-Forwarded-For": "10.0.0.1"})
+    assert resp.status == 429
+    assert resp.headers["Retry-After"] == "60"
+    monkeypatch.setattr(auth, "verify", verify)
+
+    # other clients are not affected
+    resp = await cl.get("/", auth=good, headers={"X-Forwarded-For": "10.0.0.2"})
+    assert resp.status == 200
+    resp = await cl.get("/", auth=bad, headers={"X-Forwarded-For": "10.0.0.3"})
+    assert resp.status == 401
+    assert sorted(throttle._data) == ["10.0.0.1", "10.0.0.3"]
+
+
+def test_basic_auth_no_throttle() -> None:
+    auth = BasicAuth("user", "pass", "realm")
+    assert auth.throttle is None
+    assert not auth._reads_overrides
+
+
+async def test_hashed_basic_auth_throttle(
+    aiohttp_client: AiohttpClient, users: Dict[str, str]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    auth = HashedBasicAuth(users, "realm", max_failures=1, failure_window=5)
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, auth)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "wrong"))
+    assert resp.status == 401
+    resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 429
+    assert resp.headers["Retry-After"] == "5"
+
+
+async def test_hashed_basic_auth_own_executor(
+    aiohttp_client: AiohttpClient, users: Dict[str, str]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    threads = set()
+
+    def verify(password: str, encoded: str) -> bool:
+        threads.add(threading.current_thread().name)
+        return verify_password(password, encoded)
+
+    tool = HashedBasicAuth(users, "realm", max_workers=1)
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    with mock.patch.object(basic_auth, "verify_password", verify):
+        resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+    assert resp.status == 200
+    assert len(threads) == 1
+    assert threads.pop().startswith("aiohttp_remotes-auth")
+    executor = tool._own_executor
+    assert executor is not None
+    await cl.close()
+    assert tool._own_executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(print)
+
+
+async def test_hashed_basic_auth_executor(
+    aiohttp_client: AiohttpClient, users: Dict[str, str]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    with ThreadPoolExecutor(1) as executor:
+        tool = HashedBasicAuth(users, "realm", executor=executor)
+        app = web.Application()
+        app.router.add_get("/", handler)
+        await _setup(app, tool)
+        cl = await aiohttp_client(app)
+        resp = await cl.get("/", auth=aiohttp.BasicAuth("user", "pass"))
+        assert resp.status == 200
+        assert tool._own_executor is None
+        await cl.close()
+        # a passed executor is not shut down
+        assert executor.submit(int).result() == 0
+
+
+def test_hashed_basic_auth_invalid_max_workers(users: Dict[str, str]) -> None:
+    with pytest.raises(ValueError):
+        HashedBasicAuth(users, "realm", max_workers=0)
@@ -0,0 +1,78 @@
+import pytest
+
+from aiohttp_remotes.cache import LRUCache
+
+
+def test_lru_invalid_size() -> None:
+    with pytest.raises(ValueError):
+        LRUCache[str, int](0)
+
+
+def test_lru_hit_miss() -> None:
+    cache = LRUCache[str, int](2)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert "a" in cache
+    assert len(cache) == 1
+    assert cache.maxsize == 2
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 0)
+
+
+def test_lru_eviction_order() -> None:
+    cache = LRUCache[str, int](2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_lru_clear() -> None:
+    cache = LRUCache[str, int](2)
+    cache.set("a", 1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_invalid_maxbytes() -> None:
+    with pytest.raises(ValueError):
+        LRUCache[str, int](1, 0)
+
+
+def test_lru_maxbytes() -> None:
+    cache = LRUCache[str, int](10, 10)
+    assert cache.maxbytes == 10
+    cache.set("a", 1, 4)
+    cache.set("b", 2, 4)
+    assert cache.nbytes == 8
+    cache.set("c", 3, 4)
+    assert "a" not in cache
+    assert cache.nbytes == 8
+    assert cache.evictions == 1
+
+
+def test_lru_maxbytes_replace() -> None:
+    cache = LRUCache[str, int](10, 10)
+    cache.set("a", 1, 4)
+    cache.set("a", 2, 6)
+    assert cache.nbytes == 6
+    assert cache.get("a") == 2
+
+
+def test_lru_maxbytes_too_large() -> None:
+    cache = LRUCache[str, int](10, 10)
+    cache.set("a", 1, 4)
+    cache.set("b", 2, 11)
+    assert "b" not in cache
+    assert "a" in cache
+
+
+def test_lru_clear_nbytes() -> None:
+    cache = LRUCache[str, int](10, 10)
+    cache.set("a", 1, 4)
+    cache.clear()
+    assert cache.nbytes == 0
@@ -1,6 +1,9 @@
 import asyncio
+import json
 import socket
 import ssl
+import time
+from pathlib import Path
 from typing import (
     Any,
     AsyncIterator,
@@ -21,7 +24,7 @@ from aiohttp.abc import AbstractResolver
 from aiohttp.pytest_plugin import AiohttpClient
 from aiohttp.resolver import DefaultResolver
 from aiohttp.test_utils import unused_port
-from aiohttp_remotes import Cloudflare, setup as _setup
+from aiohttp_remotes import Cloudflare, cloudflare, setup as _setup
 
 _CloudSession = Callable[..., Awaitable[aiohttp.ClientSession]]
 
@@ -68,10 +71,15 @@ class FakeCloudfare:
         *,
         ipv4: Sequence[str] = ("127.0.0.0/16",),
         ipv6: Sequence[str] = ("::/16",),
-        ssl_ctx: ssl.SSLContext
+        failures: int = 0,
+        delay: float = 0,
+        ssl_ctx: ssl.SSLContext,
     ) -> None:
         self._ipv4 = ipv4
         self._ipv6 = ipv6
+        self._failures = failures
+        self._delay = delay
+        self.requests = 0
         self.app = web.Application()
         self.app.router.add_get("/ips-v4", self.ipv4)
         self.app.router.add_get("/ips-v6", self.ipv6)
@@ -91,11 +99,19 @@ class FakeCloudfare:
         assert self.runner is not None
         await self.runner.cleanup()
 
+    async def _respond(self, masks: Sequence[str]) -> web.Response:
+        self.requests += 1
+        if self._delay:
+            await asyncio.sleep(self._delay)
+        if self.requests <= self._failures:
+            raise web.HTTPServiceUnavailable()
+        return web.Response(text="\n".join(masks))
+
     async def ipv4(self, request: web.Request) -> web.Response:
-        return web.Response(text="\n".join(self._ipv4))
+        return await self._respond(self._ipv4)
 
     async def ipv6(self, request: web.Request) -> web.Response:
-        return web.Response(text="\n".join(self._ipv6))
+        return await self._respond(self._ipv6)
 
 
 @pytest.fixture
@@ -184,3 +200,290 @@ async def test_cloudfare_garbage_config(
     cl = await aiohttp_client(app)
     async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
         assert resp.status == 200
+
+
+async def test_cloudfare_ipv6_ranges(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    cf_client = await cloudfare_session(
+        ipv4=["10.0.0.0/8", "10.10.0.0/16", "11.0.0.0/8"], ipv6=["::/16"]
+    )
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, Cloudflare(cf_client))
+    cl = await aiohttp_client(app)
+    # 127.0.0.1 is not covered, IPv6 ranges never match IPv4 peers
+    async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
+        assert resp.status == 400
+
+
+async def _wait_status(cl: Any, status: int) -> None:
+    for _ in range(100):
+        async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
+            if resp.status == status:
+                return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Status {status} was not reached")
+
+
+async def test_cloudfare_refresh(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    ipv4 = ["10.0.0.0/8"]
+    cf_client = await cloudfare_session(ipv4=ipv4, ipv6=[])
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, Cloudflare(cf_client, refresh_interval=0.01))
+    cl = await aiohttp_client(app)
+    await _wait_status(cl, 400)
+
+    ipv4[:] = ["127.0.0.0/16"]
+    await _wait_status(cl, 200)
+
+
+async def test_cloudfare_refresh_keeps_last_good(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    ipv4 = ["127.0.0.0/16"]
+    cf_client = await cloudfare_session(ipv4=ipv4, ipv6=[])
+    tool = Cloudflare(cf_client, refresh_interval=0.01)
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+
+    ipv4[:] = ["garbage"]
+    await asyncio.sleep(0.05)
+    await _wait_status(cl, 200)
+
+    await cf_client.close()
+    await asyncio.sleep(0.05)
+    await _wait_status(cl, 200)
+
+
+def test_cloudfare_invalid_refresh_interval() -> None:
+    with pytest.raises(ValueError):
+        Cloudflare(refresh_interval=0)
+
+
+async def test_cloudfare_snapshot_written(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession, tmp_path: Path
+) -> None:
+    snapshot = tmp_path / "cloudflare.json"
+    cf_client = await cloudfare_session(ipv4=["127.0.0.0/16"], ipv6=["::/16"])
+
+    app = web.Application()
+    before = time.time()
+    await _setup(app, Cloudflare(cf_client, snapshot=snapshot))
+
+    data = json.loads(snapshot.read_text())
+    assert data["networks"] == ["127.0.0.0/16", "::/16"]
+    assert data["fetched_at"] >= before
+    assert [p.name for p in tmp_path.iterdir()] == ["cloudflare.json"]
+
+
+async def test_cloudfare_snapshot_no_network(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession, tmp_path: Path
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    snapshot = tmp_path / "cloudflare.json"
+    snapshot.write_text(
+        json.dumps({"fetched_at": time.time(), "networks": ["127.0.0.0/16"]})
+    )
+    cf_client = await cloudfare_session()
+    await cf_client.close()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, Cloudflare(cf_client, snapshot=snapshot))
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
+        assert resp.status == 200
+
+
+async def test_cloudfare_fresh_snapshot_not_refreshed(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession, tmp_path: Path
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    snapshot = tmp_path / "cloudflare.json"
+    snapshot.write_text(
+        json.dumps({"fetched_at": time.time() - 1, "networks": ["127.0.0.0/16"]})
+    )
+    cf_client = await cloudfare_session()
+    await cf_client.close()
+    fetches = 0
+
+    tool = Cloudflare(cf_client, snapshot=snapshot)
+    orig_fetch = tool._fetch
+
+    async def fetch() -> Any:
+        nonlocal fetches
+        fetches += 1
+        return await orig_fetch()
+
+    tool._fetch = fetch  # type: ignore[method-assign]
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
+        assert resp.status == 200
+    await asyncio.sleep(0.05)
+    assert fetches == 0
+
+
+async def test_cloudfare_snapshot_refreshed_in_background(
+    aiohttp_client: AiohttpClient,
+    cloudfare_session: _CloudSession,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    monkeypatch.setattr(cloudflare, "SNAPSHOT_REFRESH_JITTER", 0.01)
+
+    snapshot = tmp_path / "cloudflare.json"
+    snapshot.write_text(json.dumps({"fetched_at": 1, "networks": ["10.0.0.0/8"]}))
+    cf_client = await cloudfare_session(ipv4=["127.0.0.0/16"], ipv6=[])
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, Cloudflare(cf_client, snapshot=snapshot))
+    cl = await aiohttp_client(app)
+    await _wait_status(cl, 200)
+    # the snapshot is written after the new networks are applied
+    for _ in range(100):
+        data = json.loads(snapshot.read_text())
+        if data["fetched_at"] > 1:
+            break
+        await asyncio.sleep(0.01)
+    assert data["networks"] == ["127.0.0.0/16"]
+    assert data["fetched_at"] > 1
+
+
+async def test_cloudfare_snapshot_stale(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession, tmp_path: Path
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    snapshot = tmp_path / "cloudflare.json"
+    snapshot.write_text(json.dumps({"fetched_at": 1, "networks": ["10.0.0.0/8"]}))
+    cf_client = await cloudfare_session(ipv4=["127.0.0.0/16"], ipv6=[])
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = Cloudflare(cf_client, snapshot=snapshot, snapshot_max_age=60)
+    await _setup(app, tool)
+    # the stale snapshot is ignored, setup fetches networks synchronously
+    assert json.loads(snapshot.read_text())["networks"] == ["127.0.0.0/16"]
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
+        assert resp.status == 200
+
+
+async def test_cloudfare_snapshot_garbage(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession, tmp_path: Path
+) -> None:
+    snapshot = tmp_path / "cloudflare.json"
+    snapshot.write_text("garbage")
+    cf_client = await cloudfare_session(ipv4=["127.0.0.0/16"], ipv6=[])
+
+    app = web.Application()
+    await _setup(app, Cloudflare(cf_client, snapshot=snapshot))
+    assert json.loads(snapshot.read_text())["networks"] == ["127.0.0.0/16"]
+
+
+async def test_cloudfare_snapshot_shared_refresh(
+    aiohttp_client: AiohttpClient, cloudfare_session: _CloudSession, tmp_path: Path
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    snapshot = tmp_path / "cloudflare.json"
+    cf_client = await cloudfare_session(ipv4=["10.0.0.0/8"], ipv6=[])
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, Cloudflare(cf_client, snapshot=snapshot, refresh_interval=0.05))
+    cl = await aiohttp_client(app)
+    await _wait_status(cl, 400)
+
+    # another worker on the host has refreshed the snapshot
+    snapshot.write_text(
+        json.dumps({"fetched_at": time.time(), "networks": ["127.0.0.0/16"]})
+    )
+    await _wait_status(cl, 200)
+
+
+async def test_cloudfare_fetch_retry(
+    aiohttp_client: AiohttpClient,
+    cloudfare_session: _CloudSession,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    # the first attempt fails for both lists
+    cf_client = await cloudfare_session(failures=2)
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    caplog.set_level("INFO", logger="aiohttp_remotes")
+    await _setup(app, Cloudflare(cf_client, fetch_retries=1, fetch_backoff=0.01))
+    assert "retry 1" in caplog.text
+    assert "Cloudflare setup took" in caplog.text
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"CF-CONNECTING-IP": "10.10.10.10"}) as resp:
+        assert resp.status == 200
+
+
+async def test_cloudfare_fetch_retries_exhausted(
+    cloudfare_session: _CloudSession,
+) -> None:
+    cf_client = await cloudfare_session(failures=4)
+
+    app = web.Application()
+    with pytest.raises(aiohttp.ClientResponseError):
+        await _setup(app, Cloudflare(cf_client, fetch_retries=1, fetch_backoff=0.01))
+
+
+async def test_cloudfare_fetch_timeout(cloudfare_session: _CloudSession) -> None:
+    cf_client = await cloudfare_session(delay=1)
+
+    app = web.Application()
+    with pytest.raises(asyncio.TimeoutError):
+        await _setup(app, Cloudflare(cf_client, fetch_timeout=0.05))
+
+
+async def test_cloudfare_fetch_concurrent(cloudfare_session: _CloudSession) -> None:
+    cf_client = await cloudfare_session(delay=0.2)
+
+    app = web.Application()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await _setup(app, Cloudflare(cf_client))
+    assert loop.time() - started < 0.4
+
+
+def test_cloudfare_invalid_fetch_retries() -> None:
+    with pytest.raises(ValueError):
+        Cloudflare(fetch_retries=-1)
@@ -1,6 +1,13 @@
+from typing import List, Union
+
+import pytest
+from multidict import CIMultiDict
+
 from aiohttp import web
 from aiohttp.pytest_plugin import AiohttpClient
+from aiohttp.test_utils import make_mocked_request
 from aiohttp_remotes import ForwardedRelaxed, ForwardedStrict, setup as _setup
+from aiohttp_remotes.forwarded import _parse_forwarded
 
 
 async def test_forwarded_relaxed_ok(aiohttp_client: AiohttpClient) -> None:
@@ -189,6 +196,39 @@ async def test_forwarded_strict_untrusted_ip(aiohttp_client: AiohttpClient) -> N
         assert resp.status == 400
 
 
+async def test_forwarded_strict_rejections(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    tool = ForwardedStrict([["20.20.20.20"]])
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"Forwarded": "for=10.10.10.10"}) as resp:
+        assert resp.status == 400
+    async with cl.get("/", headers={"Forwarded": "for=1.1.1.1, for=2.2.2.2"}) as resp:
+        assert resp.status == 400
+    assert tool.rejections == {"UntrustedIP": 1, "IncorrectForwardedCount": 1}
+
+
+async def test_forwarded_strict_too_many_count(
+    aiohttp_client: AiohttpClient, caplog: pytest.LogCaptureFixture
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, ForwardedStrict([["127.0.0.1"], ["10.0.0.0/8"]]))
+    cl = await aiohttp_client(app)
+    value = ", ".join(["for=10.10.10.10"] * 5)
+    async with cl.get("/", headers={"Forwarded": value}) as resp:
+        assert resp.status == 400
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Too many Forwarded values: 5, expected 2" in messages
+
+
 async def test_forwarded_strict_whitelist(aiohttp_client: AiohttpClient) -> None:
     async def handler(request: web.Request) -> web.Response:
         assert request.remote == "127.0.0.1"
@@ -213,3 +253,199 @@ async def test_forwarded_strict_no_for(aiohttp_client: AiohttpClient) -> None:
     hdr_val = ", ".join(["for=10.10.10.10", "proto=https"])
     resp = await cl.get("/", headers={"Forwarded": hdr_val})
     assert resp.status == 400
+
+
+async def test_forwarded_strict_verdict_cache(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = ForwardedStrict([["127.0.0.1"]], verdict_cache_size=16)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(2):
+        async with cl.get("/", headers={"Forwarded": "for=10.10.10.10"}) as resp:
+            assert resp.status == 200
+    assert tool.verdict_cache is not None
+    # the peer verdict comes from the per-connection cache
+    assert (tool.verdict_cache.hits, tool.verdict_cache.misses) == (0, 0)
+    assert len(tool._peer_cache) == 1
+    assert ForwardedStrict([["127.0.0.1"]]).verdict_cache is None
+
+
+async def test_forwarded_strict_multiple_levels(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        assert request.host == "example.com"
+        assert request.scheme == "https"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = ForwardedStrict([["127.0.0.1"], ["20.20.20.20"]], verdict_cache_size=16)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    hdr_val = (
+        'for=10.10.10.10;proto=https;host=example.com, for="20.20.20.20:8080"'
+        ";proto=http;host=internal"
+    )
+    for _ in range(2):
+        async with cl.get("/", headers={"Forwarded": hdr_val}) as resp:
+            assert resp.status == 200
+    assert tool.verdict_cache is not None
+    assert (tool.verdict_cache.hits, tool.verdict_cache.misses) == (1, 1)
+
+
+async def test_forwarded_strict_multiple_levels_untrusted(
+    aiohttp_client: AiohttpClient,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, ForwardedStrict([["127.0.0.1"], ["20.20.20.20"]]))
+    cl = await aiohttp_client(app)
+    hdr_val = "for=10.10.10.10, for=30.30.30.30"
+    async with cl.get("/", headers={"Forwarded": hdr_val}) as resp:
+        assert resp.status == 400
+
+
+async def test_forwarded_strict_invalid_for(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, ForwardedStrict([["127.0.0.1"]]))
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"Forwarded": "for=garbage"}) as resp:
+        assert resp.status == 400
+
+
+async def test_forwarded_strict_ipv6_node(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "2001:db8::1"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, ForwardedStrict([["127.0.0.1"]]))
+    cl = await aiohttp_client(app)
+    hdr_val = 'for="[2001:db8::1]:4711"'
+    async with cl.get("/", headers={"Forwarded": hdr_val}) as resp:
+        assert resp.status == 200
+
+
+@pytest.mark.parametrize(
+    "hdr_val,remote",
+    [
+        ('for="[2001:db8::1]:4711"', "2001:db8::1"),
+        ('for="[2001:db8::1]"', "2001:db8::1"),
+        ("for=10.10.10.10:8080", "10.10.10.10"),
+        ("for=_hidden", "127.0.0.1"),
+        ("for=unknown", "127.0.0.1"),
+    ],
+)
+async def test_forwarded_relaxed_nodes(
+    aiohttp_client: AiohttpClient, hdr_val: str, remote: str
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == remote
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, ForwardedRelaxed())
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"Forwarded": hdr_val}) as resp:
+        assert resp.status == 200
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        ["for=1.2.3.4"],
+        ["for=1.2.3.4;proto=https;host=example.com"],
+        ["For=1.2.3.4;PROTO=https, for=5.6.7.8;by=1.1.1.1"],
+        ['for="[2001:db8::1]:4711";host="exa\\mple.com"', "proto=http"],
+        ["for=1.2.3.4:80;proto=https;host=a.com;host=b.com"],
+        ["", "for=1.2.3.4"],
+        ["for=1.2.3.4 for=5.6.7.8, proto=https"],
+        ["for=1.2.3.4;garbage;proto=https, ,for=5.6.7.8"],
+        ['for="unterminated, for=5.6.7.8'],
+        ["for=[::1], for=_obf;secret=x"],
+    ],
+)
+def test_parse_forwarded_matches_aiohttp(headers: List[str]) -> None:
+    req = make_mocked_request(
+        "GET", "/", headers=CIMultiDict(("Forwarded", h) for h in headers)
+    )
+    expected = tuple(
+        (elem.get("for"), elem.get("proto"), elem.get("host")) for elem in req.forwarded
+    )
+    assert _parse_forwarded(headers) == expected
+
+
+def test_parse_forwarded_limit() -> None:
+    value = ", ".join(f"for=10.0.0.{i}" for i in range(100))
+    assert _parse_forwarded([value], 2) == (
+        ("10.0.0.0", None, None),
+        ("10.0.0.1", None, None),
+    )
+    assert _parse_forwarded(["for=a", "for=b", "for=c"], 2) == (
+        ("a", None, None),
+        ("b", None, None),
+    )
+
+
+async def test_forwarded_header_cache(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = ForwardedStrict([["127.0.0.1"]], header_cache_size=4)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(3):
+        async with cl.get("/", headers={"Forwarded": "for=10.10.10.10"}) as resp:
+            assert resp.status == 200
+    assert tool.header_cache is not None
+    assert (tool.header_cache.hits, tool.header_cache.misses) == (2, 1)
+    assert ForwardedRelaxed().header_cache is None
+
+
+@pytest.mark.parametrize(
+    "tool",
+    [
+        ForwardedRelaxed(max_header_size=64, max_elements=2),
+        ForwardedStrict([["127.0.0.1"]], max_header_size=64, max_elements=2),
+    ],
+)
+async def test_forwarded_header_limits(
+    aiohttp_client: AiohttpClient, tool: Union[ForwardedRelaxed, ForwardedStrict]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers={"Forwarded": "for=10.10.10.10"}) as resp:
+        assert resp.status == 200
+    hdr_val = "for=10.10.10.10;host=" + "a" * 64
+    async with cl.get("/", headers={"Forwarded": hdr_val}) as resp:
+        assert resp.status == 400
+    headers = [
+        ("Forwarded", "for=10.10.10.10, for=10.10.10.11"),
+        ("Forwarded", "for=1.1.1.1"),
+    ]
+    async with cl.get("/", headers=headers) as resp:
+        assert resp.status == 400
+    assert tool.header_limits.headers_too_large == 1
+    assert tool.header_limits.too_many_elements == 1
@@ -0,0 +1,189 @@
+from typing import Any
+
+import pytest
+
+import aiohttp
+from aiohttp import web
+from aiohttp.pytest_plugin import AiohttpClient
+from aiohttp_remotes import (
+    AllowedHosts,
+    BasicAuth,
+    ForwardedRelaxed,
+    Secure,
+    XForwardedRelaxed,
+    XForwardedStrict,
+    resolved,
+    setup as _setup,
+)
+
+AUTH = aiohttp.BasicAuth("user", "pass").encode()
+
+
+@pytest.fixture
+def clones(monkeypatch: pytest.MonkeyPatch) -> Any:
+    counter = {"count": 0}
+    orig = web.Request.clone
+
+    def clone(self: web.Request, **kwargs: Any) -> web.Request:
+        counter["count"] += 1
+        return orig(self, **kwargs)
+
+    monkeypatch.setattr(web.Request, "clone", clone)
+    return counter
+
+
+async def _make_app(fuse: bool) -> web.Application:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.host == "example.com"
+        assert request.scheme == "https"
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(
+        app,
+        XForwardedStrict([["127.0.0.1"]]),
+        AllowedHosts(["example.com"]),
+        Secure(),
+        BasicAuth("user", "pass", "realm"),
+        fuse=fuse,
+    )
+    return app
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+async def test_fused_ok(aiohttp_client: AiohttpClient, clones: Any, fuse: bool) -> None:
+    app = await _make_app(fuse)
+    assert len(app.middlewares) == (1 if fuse else 4)
+    cl = await aiohttp_client(app)
+    headers = {
+        "X-Forwarded-For": "10.10.10.10",
+        "X-Forwarded-Proto": "https",
+        "X-Forwarded-Host": "example.com",
+        "Authorization": AUTH,
+    }
+    async with cl.get("/", headers=headers) as resp:
+        assert resp.status == 200
+        assert resp.headers["X-Frame-Options"] == "DENY"
+    assert clones["count"] == 1
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize(
+    "headers,status",
+    [
+        # wrong host
+        (
+            {
+                "X-Forwarded-For": "10.10.10.10",
+                "X-Forwarded-Proto": "https",
+                "X-Forwarded-Host": "example.org",
+                "Authorization": AUTH,
+            },
+            400,
+        ),
+        # not secure
+        (
+            {
+                "X-Forwarded-For": "10.10.10.10",
+                "X-Forwarded-Proto": "http",
+                "X-Forwarded-Host": "example.com",
+                "Authorization": AUTH,
+            },
+            308,
+        ),
+        # no credentials
+        (
+            {
+                "X-Forwarded-For": "10.10.10.10",
+                "X-Forwarded-Proto": "https",
+                "X-Forwarded-Host": "example.com",
+            },
+            401,
+        ),
+        # too many hops
+        (
+            {
+                "X-Forwarded-For": "10.10.10.10, 11.11.11.11",
+                "X-Forwarded-Proto": "https",
+                "X-Forwarded-Host": "example.com",
+                "Authorization": AUTH,
+            },
+            400,
+        ),
+    ],
+)
+async def test_fused_reject(
+    aiohttp_client: AiohttpClient, fuse: bool, headers: Any, status: int
+) -> None:
+    app = await _make_app(fuse)
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers=headers, allow_redirects=False) as resp:
+        assert resp.status == status
+
+
+async def test_fused_producers_only(aiohttp_client: AiohttpClient, clones: Any) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, XForwardedRelaxed(), BasicAuth("u", "p", "r"), fuse=True)
+    cl = await aiohttp_client(app)
+    headers = {
+        "X-Forwarded-For": "10.10.10.10",
+        "Authorization": aiohttp.BasicAuth("u", "p").encode(),
+    }
+    async with cl.get("/", headers=headers) as resp:
+        assert resp.status == 200
+    assert clones["count"] == 1
+
+
+@pytest.mark.parametrize("clone", [True, False])
+async def test_fused_single_clone_with_readers(
+    aiohttp_client: AiohttpClient, clones: Any, clone: bool
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        info = resolved(request)
+        assert info.remote == "11.11.11.11"
+        assert info.host == "a.com"
+        assert info.scheme == "https"
+        if clone:
+            assert request.remote == "11.11.11.11"
+            assert request.host == "a.com"
+            assert request.scheme == "https"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(
+        app,
+        XForwardedRelaxed(clone=clone),
+        AllowedHosts(["a.com"]),
+        ForwardedRelaxed(clone=clone),
+        Secure(),
+        fuse=True,
+    )
+    cl = await aiohttp_client(app)
+    headers = {
+        "X-Forwarded-For": "10.10.10.10",
+        "X-Forwarded-Host": "a.com",
+        "Forwarded": "for=11.11.11.11;proto=https",
+    }
+    async with cl.get("/", headers=headers, allow_redirects=False) as resp:
+        assert resp.status == 200
+    assert clones["count"] == (1 if clone else 0)
+
+
+async def test_fused_not_a_tool() -> None:
+    class Tool:
+        async def setup(self, app: web.Application) -> None:
+            pass  # pragma: no cover
+
+    app = web.Application()
+    with pytest.raises(TypeError):
+        await _setup(app, Secure(), Tool(), fuse=True)
+    assert not app.middlewares
+    assert not app.on_response_prepare
@@ -0,0 +1,122 @@
+from typing import List, Optional, Tuple
+
+import pytest
+
+from aiohttp import web
+from aiohttp.pytest_plugin import AiohttpClient
+from aiohttp_remotes import (
+    AllowedHosts,
+    Histogram,
+    HistogramSink,
+    Secure,
+    XForwardedStrict,
+    setup as _setup,
+)
+
+
+class ListSink:
+    def __init__(self) -> None:
+        self.records: List[Tuple[str, str, Optional[str]]] = []
+
+    def record(
+        self, name: str, elapsed: float, outcome: str, reason: Optional[str]
+    ) -> None:
+        assert elapsed >= 0
+        self.records.append((name, outcome, reason))
+
+
+async def handler(request: web.Request) -> web.Response:
+    return web.Response()
+
+
+def test_histogram() -> None:
+    hist = Histogram([0.001, 0.01, 0.1])
+    assert hist.quantile(0.5) == 0.0
+    for elapsed in (0.0005, 0.005, 0.005, 0.05, 0.5):
+        hist.add(elapsed, "pass", None)
+    hist.add(0.005, "reject", "UntrustedIP")
+    assert hist.count == 6
+    assert hist.buckets == [1, 3, 1, 1]
+    assert hist.max == 0.5
+    assert hist.mean == pytest.approx(0.5655 / 6)
+    assert hist.quantile(0) == 0.001
+    assert hist.quantile(0.5) == 0.01
+    assert hist.quantile(0.8) == 0.1
+    assert hist.quantile(1) == 0.5
+    assert hist.outcomes == {"pass": 5, "reject": 1}
+    assert hist.reasons == {"UntrustedIP": 1}
+
+
+def test_histogram_quantile_out_of_range() -> None:
+    with pytest.raises(ValueError):
+        Histogram().quantile(1.5)
+
+
+def test_histogram_sink() -> None:
+    sink = HistogramSink()
+    sink.record("a", 0.001, "pass", None)
+    sink.record("a", 0.002, "override", None)
+    sink.record("b", 0.001, "pass", None)
+    assert list(sink) == ["a", "b"]
+    assert len(sink) == 2
+    assert "a" in sink
+    assert sink["a"].count == 2
+    sink.clear()
+    assert len(sink) == 0
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+async def test_instrument(aiohttp_client: AiohttpClient, fuse: bool) -> None:
+    sink = ListSink()
+    xff = XForwardedStrict([["127.0.0.1"]])
+    hosts = AllowedHosts(["example.com"])
+    secure = Secure()
+    xff.instrument(sink)
+    hosts.instrument(sink, "hosts")
+    secure.instrument(sink)
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, xff, hosts, secure, fuse=fuse)
+    cl = await aiohttp_client(app)
+
+    headers = {
+        "X-Forwarded-For": "10.10.10.10",
+        "X-Forwarded-Proto": "https",
+        "X-Forwarded-Host": "example.com",
+    }
+    resp = await cl.get("/", headers=headers)
+    assert resp.status == 200
+    assert sink.records == [
+        ("XForwardedStrict", "override", None),
+        ("hosts", "pass", None),
+        ("Secure", "pass", None),
+    ]
+
+    sink.records.clear()
+    headers["X-Forwarded-Host"] = "other.com"
+    resp = await cl.get("/", headers=headers)
+    assert resp.status == 400
+    assert sink.records == [
+        ("XForwardedStrict", "override", None),
+        ("hosts", "reject", "HTTPBadRequest"),
+    ]
+
+    sink.records.clear()
+    headers["X-Forwarded-For"] = "10.10.10.10, 10.0.0.1"
+    resp = await cl.get("/", headers=headers)
+    assert resp.status == 400
+    assert sink.records == [("XForwardedStrict", "reject", "IncorrectIPCount")]
+
+
+async def test_instrument_disable(aiohttp_client: AiohttpClient) -> None:
+    sink = HistogramSink()
+    secure = Secure()
+    secure.instrument(sink)
+    secure.instrument(None)
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, secure)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", allow_redirects=False)
+    assert resp.status == 308
+    assert len(sink) == 0
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import threading
+import time
+from ipaddress import ip_address
+from typing import Dict, Iterator, List
+
+import pytest
+
+from aiohttp import web
+from aiohttp.pytest_plugin import AiohttpClient
+from aiohttp.test_utils import make_mocked_request
+from aiohttp_remotes import LogLimiter, QueueLogging, error_log_limiter
+from aiohttp_remotes.exceptions import IncorrectIPCount, UntrustedIP
+from aiohttp_remotes.log import logger
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def limiter() -> Iterator[LogLimiter]:
+    clock = error_log_limiter._clock
+    yield error_log_limiter
+    error_log_limiter._clock = clock
+    error_log_limiter.configure()
+
+
+def _messages(caplog: pytest.LogCaptureFixture) -> List[str]:
+    return [record.getMessage() for record in caplog.records]
+
+
+def test_log_limiter_rate() -> None:
+    clock = Clock()
+    limiter = LogLimiter(rate=1, burst=2, clock=clock)
+    assert limiter.allow("a") == 0
+    assert limiter.allow("a") == 0
+    assert limiter.allow("a") is None
+    assert limiter.allow("a") is None
+    assert limiter.suppressed("a") == 2
+    # other keys have own buckets
+    assert limiter.allow("b") == 0
+    clock.now = 1.0
+    assert limiter.allow("a") == 2
+    assert limiter.allow("a") is None
+
+
+def test_log_limiter_sample() -> None:
+    limiter = LogLimiter(rate=None, sample=3)
+    assert [limiter.allow("a") for i in range(7)] == [
+        0,
+        None,
+        None,
+        2,
+        None,
+        None,
+        2,
+    ]
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"rate": 0}, {"burst": 0}, {"sample": 0}, {"rate": -1.0}]
+)
+def test_log_limiter_invalid(kwargs: Dict[str, float]) -> None:
+    with pytest.raises(ValueError):
+        LogLimiter(**kwargs)  # type: ignore[arg-type]
+
+
+def test_log_limiter_flush(caplog: pytest.LogCaptureFixture) -> None:
+    limiter = LogLimiter(rate=1, burst=1, clock=Clock())
+    limiter.allow("UntrustedIP")
+    limiter.allow("UntrustedIP")
+    limiter.allow("UntrustedIP")
+    limiter.flush()
+    assert _messages(caplog) == ["2 UntrustedIP messages suppressed"]
+    assert limiter.suppressed("UntrustedIP") == 0
+    limiter.flush()
+    assert len(caplog.records) == 1
+
+
+def test_remote_error_log_once(
+    caplog: pytest.LogCaptureFixture, limiter: LogLimiter
+) -> None:
+    req = make_mocked_request("GET", "/")
+    UntrustedIP(ip_address("10.0.0.1"), [ip_address("10.0.0.2")]).log(req)
+    assert _messages(caplog) == [
+        "Untrusted IP: 10.0.0.1, trusted: [IPv4Address('10.0.0.2')]"
+    ]
+    assert caplog.records[0].request is req  # type: ignore[attr-defined]
+
+
+def test_remote_error_log_limited(
+    caplog: pytest.LogCaptureFixture, limiter: LogLimiter
+) -> None:
+    clock = Clock()
+    limiter._clock = clock
+    limiter.configure(rate=1, burst=1)
+    req = make_mocked_request("GET", "/")
+    exc = IncorrectIPCount(1, [ip_address("10.0.0.1")] * 2)
+    for i in range(5):
+        exc.log(req)
+    assert len(caplog.records) == 1
+    clock.now = 1.0
+    exc.log(req)
+    assert _messages(caplog)[1:] == [
+        "4 IncorrectIPCount messages suppressed",
+        "Too many X-Forwarded-For values: "
+        "[IPv4Address('10.0.0.1'), IPv4Address('10.0.0.1')], expected 1",
+    ]
+
+
+def test_remote_error_log_unlimited_by_default(
+    caplog: pytest.LogCaptureFixture, limiter: LogLimiter
+) -> None:
+    assert limiter.rate is None
+    req = make_mocked_request("GET", "/")
+    exc = IncorrectIPCount(1, [])
+    for i in range(50):
+        exc.log(req)
+    assert len(caplog.records) == 50
+
+
+async def test_log_limiter_periodic_flush(
+    aiohttp_client: AiohttpClient, caplog: pytest.LogCaptureFixture
+) -> None:
+    limiter = LogLimiter(rate=1, burst=1)
+    app = web.Application()
+    await limiter.setup(app, interval=0.01)
+    cl = await aiohttp_client(app)
+    limiter.allow("UntrustedIP")
+    limiter.allow("UntrustedIP")
+    for i in range(100):
+        if caplog.records:
+            break
+        await asyncio.sleep(0.01)
+    assert _messages(caplog) == ["1 UntrustedIP messages suppressed"]
+    limiter.allow("UntrustedIP")
+    await cl.close()
+    # flushed on cleanup
+    assert _messages(caplog)[1:] == ["1 UntrustedIP messages suppressed"]
+
+
+async def test_log_limiter_invalid_interval() -> None:
+    with pytest.raises(ValueError):
+        await LogLimiter().setup(web.Application(), interval=0)
+
+
+def test_remote_error_log_disabled(
+    caplog: pytest.LogCaptureFixture, limiter: LogLimiter
+) -> None:
+    limiter.configure(rate=1)
+    caplog.set_level(logging.CRITICAL, logger="aiohttp_remotes")
+    req = make_mocked_request("GET", "/")
+    UntrustedIP(ip_address("10.0.0.1"), []).log(req)
+    assert caplog.records == []
+    # disabled logger does not consume the budget
+    assert limiter.suppressed("UntrustedIP") == 0
+    assert "UntrustedIP" not in limiter._buckets
+
+
+class BlockingHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.event = threading.Event()
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.event.wait()
+        self.messages.append(record.getMessage())
+
+
+@pytest.mark.parametrize(
+    "drop,expected", [("newest", ["0", "1", "2"]), ("oldest", ["0", "3", "4"])]
+)
+def test_queue_logging_drop(drop: str, expected: List[str]) -> None:
+    handler = BlockingHandler()
+    ql = QueueLogging([handler], maxsize=2, drop=drop)
+    ql.start()
+    try:
+        logger.error("0")
+        # wait for the listener thread to block on the first record
+        while ql._handler is not None and ql._handler._queue.qsize():
+            time.sleep(0.001)
+        for i in range(1, 5):
+            logger.error("%s", i)
+        assert ql.dropped == 2
+    finally:
+        handler.event.set()
+        ql.stop()
+    assert handler.messages == expected
+    assert ql.dropped == 2
+    assert not ql.running
+
+
+def test_queue_logging_invalid() -> None:
+    with pytest.raises(ValueError):
+        QueueLogging(maxsize=0)
+    with pytest.raises(ValueError):
+        QueueLogging(drop="random")
+
+
+async def test_queue_logging_app(aiohttp_client: AiohttpClient) -> None:
+    handler = BlockingHandler()
+    handler.event.set()
+    saved = list(logger.handlers)
+    ql = QueueLogging([handler])
+    app = web.Application()
+    await ql.setup(app)
+    assert not ql.running
+    cl = await aiohttp_client(app)
+    assert ql.running
+    assert logger.handlers != saved
+    with pytest.raises(RuntimeError):
+        ql.start()
+    logger.error("message")
+    await cl.close()
+    assert not ql.running
+    assert logger.handlers == saved
+    assert logger.propagate
+    assert handler.messages == ["message"]
@@ -0,0 +1,128 @@
+from typing import Any
+
+import pytest
+
+from aiohttp import web
+from aiohttp.pytest_plugin import AiohttpClient
+from aiohttp.test_utils import make_mocked_request
+from aiohttp_remotes import (
+    AllowedHosts,
+    ForwardedRelaxed,
+    Secure,
+    XForwardedRelaxed,
+    resolved,
+    setup as _setup,
+)
+from aiohttp_remotes.resolved import RESOLVED_KEY, apply_overrides, has_overrides
+
+HEADERS = {
+    "X-Forwarded-For": "10.10.10.10",
+    "X-Forwarded-Proto": "https",
+    "X-Forwarded-Host": "example.com",
+}
+
+
+@pytest.fixture
+def clones(monkeypatch: pytest.MonkeyPatch) -> Any:
+    counter = {"count": 0}
+    orig = web.Request.clone
+
+    def clone(self: web.Request, **kwargs: Any) -> web.Request:
+        counter["count"] += 1
+        return orig(self, **kwargs)
+
+    monkeypatch.setattr(web.Request, "clone", clone)
+    return counter
+
+
+def test_resolved_no_overrides() -> None:
+    req = make_mocked_request("GET", "/path?a=b", headers={"Host": "example.org"})
+    info = resolved(req)
+    assert info.remote == req.remote
+    assert info.scheme == "http"
+    assert info.host == "example.org"
+    assert not info.secure
+    assert info.url is req.url
+    assert not has_overrides(req)
+
+
+def test_resolved_overrides() -> None:
+    req = make_mocked_request("GET", "/path?a=b", headers={"Host": "example.org"})
+    ret = apply_overrides(req, {"scheme": "https", "host": "example.com"}, False)
+    assert ret is req
+    assert has_overrides(req)
+    info = resolved(req)
+    assert info.scheme == "https"
+    assert info.secure
+    assert info.host == "example.com"
+    assert str(info.url) == "https://example.com/path?a=b"
+    assert req.scheme == "http"
+
+
+def test_apply_overrides_merge() -> None:
+    req = make_mocked_request("GET", "/")
+    apply_overrides(req, {"remote": "10.10.10.10", "host": "a.com"}, False)
+    apply_overrides(req, {"remote": "11.11.11.11"}, False)
+    assert req[RESOLVED_KEY] == {"remote": "11.11.11.11", "host": "a.com"}
+
+    cloned = apply_overrides(req, {"host": "b.com"}, True)
+    assert cloned is not req
+    assert cloned.host == "b.com"
+    assert resolved(cloned).host == "b.com"
+    assert resolved(cloned).remote == "11.11.11.11"
+
+
+async def test_no_clone_without_overrides(
+    aiohttp_client: AiohttpClient, clones: Any
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, XForwardedRelaxed(), ForwardedRelaxed())
+    cl = await aiohttp_client(app)
+    async with cl.get("/") as resp:
+        assert resp.status == 200
+    assert clones["count"] == 0
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+async def test_store_overrides(
+    aiohttp_client: AiohttpClient, clones: Any, fuse: bool
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "127.0.0.1"
+        info = resolved(request)
+        assert info.remote == "10.10.10.10"
+        assert info.host == "example.com"
+        assert info.secure
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(
+        app,
+        XForwardedRelaxed(clone=False),
+        AllowedHosts(["example.com"]),
+        Secure(),
+        fuse=fuse,
+    )
+    cl = await aiohttp_client(app)
+    async with cl.get("/", headers=HEADERS) as resp:
+        assert resp.status == 200
+    assert clones["count"] == 0
+
+
+async def test_store_overrides_secure_redirect(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()  # pragma: no cover
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, XForwardedRelaxed(clone=False), Secure())
+    cl = await aiohttp_client(app)
+    headers = dict(HEADERS, **{"X-Forwarded-Proto": "http"})
+    async with cl.get("/path", headers=headers, allow_redirects=False) as resp:
+        assert resp.status == 308
+        assert resp.headers["Location"] == "https://example.com/path"
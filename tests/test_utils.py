@@ -1,9 +1,28 @@
+import copy
+import gc
 from ipaddress import IPv4Address, IPv6Address, ip_address, ip_network
+from typing import Dict, Tuple
 
 import pytest
 
-from aiohttp_remotes.exceptions import IncorrectIPCount, UntrustedIP
-from aiohttp_remotes.utils import parse_trusted_list, remote_ip
+from aiohttp_remotes.exceptions import (
+    HeaderTooLarge,
+    IncorrectIPCount,
+    TooManyElements,
+    UntrustedIP,
+)
+from aiohttp_remotes.utils import (
+    HeaderLimits,
+    PeerCache,
+    TrustedElement,
+    VerdictCache,
+    check_ip,
+    is_trusted,
+    parse_trusted_element,
+    parse_trusted_list,
+    remote_ip,
+    untrusted_level,
+)
 
 
 def test_parse_str() -> None:
@@ -56,6 +75,74 @@ def test_parse_ellipsis_after_address() -> None:
         parse_trusted_list([..., ["127.0.0.1"]])
 
 
+def test_parse_compiles_elements() -> None:
+    ret = parse_trusted_list([["127.0.0.1", "10.0.0.0/8"], ...])
+    assert isinstance(ret[0], TrustedElement)
+    assert ret == [[IPv4Address("127.0.0.1"), ip_network("10.0.0.0/8")], ...]
+
+
+def test_trusted_element_read_only() -> None:
+    trusted = parse_trusted_element(["10.0.0.0/8"])
+    ip = ip_address("127.0.0.1")
+    with pytest.raises(TypeError):
+        trusted.append(ip)
+    with pytest.raises(TypeError):
+        trusted.extend([ip])
+    with pytest.raises(TypeError):
+        trusted += [ip]
+    with pytest.raises(TypeError):
+        trusted[0] = ip
+    with pytest.raises(TypeError):
+        del trusted[0]
+    assert trusted == [ip_network("10.0.0.0/8")]
+    assert not trusted.contains_ip(ip)
+    copied = copy.deepcopy(trusted)
+    assert isinstance(copied, TrustedElement)
+    assert copied == trusted
+    assert copied.contains_ip(ip_address("10.1.2.3"))
+
+
+# --------------------- check_ip -----------------------
+
+
+def test_check_ip_merged_networks() -> None:
+    trusted = parse_trusted_element(
+        ["10.0.0.0/16", "10.0.128.0/17", "10.1.0.0/16", "10.0.0.5", "192.168.1.1"]
+    )
+    check_ip(trusted, ip_address("10.0.0.5"))
+    check_ip(trusted, ip_address("10.1.255.255"))
+    check_ip(trusted, ip_address("192.168.1.1"))
+    for ip in ("9.255.255.255", "10.2.0.0", "192.168.1.0", "192.168.1.2"):
+        with pytest.raises(UntrustedIP):
+            check_ip(trusted, ip_address(ip))
+
+
+def test_check_ip_large_list() -> None:
+    networks = [f"10.{i // 256}.{i % 256}.0/24" for i in range(0, 4096, 2)]
+    trusted = parse_trusted_element(networks)
+    check_ip(trusted, ip_address("10.0.0.1"))
+    check_ip(trusted, ip_address("10.15.254.255"))
+    with pytest.raises(UntrustedIP):
+        check_ip(trusted, ip_address("10.0.1.1"))
+    with pytest.raises(UntrustedIP):
+        check_ip(trusted, ip_address("10.16.0.0"))
+
+
+def test_check_ip_versions_are_separate() -> None:
+    trusted = parse_trusted_element(["0.0.0.0/0", "::1"])
+    check_ip(trusted, ip_address("::1"))
+    with pytest.raises(UntrustedIP):
+        check_ip(trusted, ip_address("::2"))
+    with pytest.raises(UntrustedIP):
+        check_ip(parse_trusted_element(["::/0"]), ip_address("127.0.0.1"))
+
+
+def test_check_ip_plain_sequence() -> None:
+    check_ip([ip_network("10.0.0.0/8")], ip_address("10.10.10.10"))
+    with pytest.raises(UntrustedIP):
+        check_ip([ip_address("10.0.0.1")], ip_address("10.10.10.10"))
+
+
 # --------------------- remote_ip -----------------------
 
 
@@ -117,3 +204,135 @@ def test_remote_with_ellipsis() -> None:
     ]
     trusted = parse_trusted_list([["10.10.0.0/16"], ...])
     assert ips[-2] == remote_ip(trusted, ips)
+
+
+def test_remote_ip_verdict_cache() -> None:
+    ips = [
+        ip_address("10.10.10.10"),
+        ip_address("20.20.20.20"),
+        ip_address("30.30.30.30"),
+    ]
+    trusted = parse_trusted_list([["10.10.0.0/16"], ["20.20.20.20"]])
+    cache = VerdictCache(16)
+    assert ips[-1] == remote_ip(trusted, ips, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert ips[-1] == remote_ip(trusted, ips, cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_check_ip_verdict_cache_negative() -> None:
+    trusted = parse_trusted_element(["10.0.0.0/8"])
+    cache = VerdictCache(1)
+    for _ in range(2):
+        with pytest.raises(UntrustedIP):
+            check_ip(trusted, ip_address("20.20.20.20"), cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    check_ip(trusted, ip_address("10.10.10.10"), cache)
+    assert cache.evictions == 1
+
+
+def test_check_ip_verdict_cache_levels() -> None:
+    cache = VerdictCache(16)
+    ip = ip_address("10.10.10.10")
+    check_ip(parse_trusted_element(["10.0.0.0/8"]), ip, cache, 0)
+    with pytest.raises(UntrustedIP):
+        check_ip(parse_trusted_element(["20.0.0.0/8"]), ip, cache, 1)
+    assert len(cache) == 2
+
+
+def test_remote_ip_known_first_verdict() -> None:
+    trusted = parse_trusted_list([["10.0.0.1"], ["10.0.0.2"]])
+    ips = [ip_address("127.0.0.1"), ip_address("10.0.0.2"), ip_address("1.1.1.1")]
+    assert remote_ip(trusted, ips, first=True) == ip_address("1.1.1.1")
+    with pytest.raises(UntrustedIP):
+        remote_ip(trusted, ips, first=False)
+
+
+class _Transport:
+    def __init__(self, peer: str) -> None:
+        self.peer = peer
+        self.calls = 0
+        self.closing = False
+
+    def get_extra_info(self, name: str) -> Tuple[str, int]:
+        assert name == "peername"
+        self.calls += 1
+        return (self.peer, 12345)
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+
+def test_peer_cache() -> None:
+    cache = PeerCache(parse_trusted_list([["10.0.0.1"]]))
+    tr = _Transport("10.0.0.1")
+    assert cache.get(tr) == (ip_address("10.0.0.1"), True)
+    assert cache.get(tr) == (ip_address("10.0.0.1"), True)
+    assert tr.calls == 1
+    assert cache.get(_Transport("10.0.0.2")) == (ip_address("10.0.0.2"), False)
+    del tr
+    gc.collect()
+    assert len(cache) == 0
+
+
+def test_peer_cache_no_first_level_verdict() -> None:
+    tr = _Transport("10.0.0.1")
+    assert PeerCache([]).get(tr) == (ip_address("10.0.0.1"), None)
+    assert PeerCache([...]).get(tr) == (ip_address("10.0.0.1"), None)
+
+
+def test_peer_cache_closing_transport() -> None:
+    cache = PeerCache(parse_trusted_list([["10.0.0.1"]]))
+    tr = _Transport("10.0.0.1")
+    tr.closing = True
+    cache.get(tr)
+    assert len(cache) == 0
+
+
+def test_is_trusted() -> None:
+    trusted = parse_trusted_element(["10.0.0.0/8", "127.0.0.1"])
+    assert is_trusted(trusted, ip_address("10.1.2.3"))
+    assert is_trusted(trusted, ip_address("127.0.0.1"))
+    assert not is_trusted(trusted, ip_address("20.20.20.20"))
+    assert not is_trusted([ip_network("10.0.0.0/8")], ip_address("20.20.20.20"))
+
+
+def test_is_trusted_verdict_cache() -> None:
+    trusted = parse_trusted_element(["10.0.0.0/8"])
+    cache = VerdictCache(4)
+    for _ in range(2):
+        assert not is_trusted(trusted, ip_address("20.20.20.20"), cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_untrusted_level() -> None:
+    trusted = parse_trusted_list([["10.0.0.1"], ["10.0.0.2"], ...])
+    ips = [ip_address("10.0.0.1"), ip_address("10.0.0.2"), ip_address("1.1.1.1")]
+    assert untrusted_level(trusted, ips) == -1
+    assert untrusted_level(trusted, ips, first=False) == 0
+    ips[1] = ip_address("10.0.0.3")
+    assert untrusted_level(trusted, ips) == 1
+    assert untrusted_level([], ips[:1]) == -1
+
+
+def test_header_limits() -> None:
+    limits = HeaderLimits(max_header_size=20, max_elements=2)
+    assert (limits.max_header_size, limits.max_elements) == (20, 2)
+    limits.check("X-Forwarded-For", ["10.0.0.1, 10.0.0.2"])
+    with pytest.raises(HeaderTooLarge):
+        limits.check("X-Forwarded-For", ["10.0.0.1, 10.0.0.2, 10.0.0.3"])
+    with pytest.raises(TooManyElements):
+        limits.check("Forwarded", ["for=a", "for=b,for=c"])
+    assert (limits.headers_too_large, limits.too_many_elements) == (1, 1)
+
+
+def test_header_limits_disabled() -> None:
+    limits = HeaderLimits()
+    limits.check("X-Forwarded-For", [", ".join(["10.0.0.1"] * 10000)])
+    assert (limits.headers_too_large, limits.too_many_elements) == (0, 0)
+
+
+@pytest.mark.parametrize("kwargs", [{"max_header_size": 0}, {"max_elements": -1}])
+def test_header_limits_invalid(kwargs: Dict[str, int]) -> None:
+    with pytest.raises(ValueError):
+        HeaderLimits(**kwargs)
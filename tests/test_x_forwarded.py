@@ -1,13 +1,22 @@
+import gc
+from functools import partial
+from ipaddress import ip_address, ip_network
+from typing import Callable, Dict, List
+
 import pytest
+from multidict import CIMultiDict
 
 from aiohttp import web
 from aiohttp.pytest_plugin import AiohttpClient
+from aiohttp.test_utils import make_mocked_request
 from aiohttp_remotes import (
     XForwardedFiltered,
     XForwardedRelaxed,
     XForwardedStrict,
+    rejections,
     setup as _setup,
 )
+from aiohttp_remotes.x_forwarded import XForwardedBase
 
 
 async def test_x_forwarded_relaxed_ok(aiohttp_client: AiohttpClient) -> None:
@@ -55,6 +64,34 @@ async def test_x_forwarded_relaxed_no_forwards(aiohttp_client: AiohttpClient) ->
     assert resp.status == 200
 
 
+@pytest.mark.parametrize(
+    "headers,expected",
+    [
+        ({}, False),
+        ({"Host": "example.com", "Forwarded": "for=1.2.3.4"}, False),
+        ({"x-forwarded-for": "10.10.10.10"}, True),
+        ({"X-FORWARDED-PROTO": "https"}, True),
+        ({"X-Forwarded-Host": "example.com"}, True),
+    ],
+)
+def test_x_forwarded_has_forwarded(headers: Dict[str, str], expected: bool) -> None:
+    assert XForwardedRelaxed().has_forwarded(CIMultiDict(headers)) is expected
+
+
+@pytest.mark.parametrize(
+    "tool", [XForwardedRelaxed(), XForwardedFiltered(["127.0.0.1"])]
+)
+async def test_x_forwarded_no_headers_fast_path(
+    tool: XForwardedRelaxed, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fail(*args: object) -> None:
+        raise AssertionError("headers should not be parsed")
+
+    monkeypatch.setattr(tool, "_get_header", fail)
+    req = make_mocked_request("GET", "/", headers={"Host": "example.com"})
+    assert await tool.process(req) is None
+
+
 async def test_x_forwarded_relaxed_multiple_for(aiohttp_client: AiohttpClient) -> None:
     async def handler(request: web.Request) -> web.Response:
         return web.Response()
@@ -117,6 +154,46 @@ async def test_x_forwarded_relaxed_multiple_host(aiohttp_client: AiohttpClient)
     assert resp.status == 400
 
 
+@pytest.mark.parametrize("num", [1, 2, 3])
+@pytest.mark.parametrize(
+    "value",
+    [
+        "10.0.0.1",
+        "10.0.0.1, 10.0.0.2",
+        "10.0.0.1,10.0.0.2 ,  10.0.0.3",
+        "::1, 10.0.0.2, 2001:db8::1, 10.0.0.4",
+    ],
+)
+async def test_x_forwarded_relaxed_tail_matches_full_parse(
+    num: int, value: str
+) -> None:
+    headers = {
+        "X-Forwarded-For": value,
+        "X-Forwarded-Proto": value,
+        "X-Forwarded-Host": value,
+    }
+    tool = XForwardedRelaxed(num)
+    req = make_mocked_request("GET", "/", headers=headers)
+    forwarded_for = tool.get_forwarded_for(req.headers)
+    if num > len(forwarded_for):
+        with pytest.raises(web.HTTPBadRequest):
+            await tool.process(req)
+        return
+    expected = {
+        "remote": str(forwarded_for[-num]),
+        "scheme": tool.get_forwarded_proto(req.headers)[-num],
+        "host": tool.get_forwarded_host(req.headers)[-num],
+    }
+    assert await tool.process(req) == expected
+
+
+async def test_x_forwarded_relaxed_long_header() -> None:
+    # Only the last element is parsed, garbage before it is not touched
+    value = ", ".join(["garbage"] * 10000 + ["10.10.10.10"])
+    req = make_mocked_request("GET", "/", headers={"X-Forwarded-For": value})
+    assert await XForwardedRelaxed().process(req) == {"remote": "10.10.10.10"}
+
+
 async def test_x_forwarded_filtered_ok(aiohttp_client: AiohttpClient) -> None:
     async def handler(request: web.Request) -> web.Response:
         assert request.host == "example.com"
@@ -141,6 +218,80 @@ async def test_x_forwarded_filtered_ok(aiohttp_client: AiohttpClient) -> None:
     assert resp.status == 200
 
 
+def _filtered_reference(
+    trusted: List[str], xff: List[str], proto: List[str], host: List[str]
+) -> Dict[str, str]:
+    # straightforward full-copy implementation of the selection rules
+    nets = [ip_network(t) for t in trusted]
+    ips = list(reversed(xff))
+    index = -1
+    remote = ips[-1]
+    for i, ip in enumerate(ips):
+        if not any(ip_address(ip) in net for net in nets):
+            index, remote = i, ip
+            break
+    ret = {"remote": remote}
+    for key, values in (("scheme", proto), ("host", host)):
+        rev = list(reversed(values))
+        if rev:
+            if index >= len(rev):
+                index = -1
+            ret[key] = rev[index]
+    return ret
+
+
+@pytest.mark.parametrize("header_cache_size", [0, 16])
+@pytest.mark.parametrize(
+    "xff",
+    [
+        ["10.0.0.1"],
+        ["1.1.1.1"],
+        ["1.1.1.1", "10.0.0.1"],
+        ["2.2.2.2", "1.1.1.1", "10.0.0.1"],
+        ["10.0.0.2", "10.0.0.1"],
+        ["1.1.1.1", "10.0.0.2", "10.0.0.1"],
+    ],
+)
+@pytest.mark.parametrize(
+    "proto,host",
+    [
+        ([], []),
+        (["https"], ["a.com"]),
+        (["https", "http"], ["a.com"]),
+        (["https", "http", "http"], ["a.com", "b.com", "c.com"]),
+    ],
+)
+async def test_x_forwarded_filtered_matches_reference(
+    header_cache_size: int, xff: List[str], proto: List[str], host: List[str]
+) -> None:
+    trusted = ["10.0.0.0/24"]
+    headers = {"X-Forwarded-For": ", ".join(xff)}
+    if proto:
+        headers["X-Forwarded-Proto"] = ", ".join(proto)
+    if host:
+        headers["X-Forwarded-Host"] = ", ".join(host)
+    tool = XForwardedFiltered(trusted, header_cache_size=header_cache_size)
+    req = make_mocked_request("GET", "/", headers=headers)
+    expected = _filtered_reference(trusted, xff, proto, host)
+    assert await tool.process(req) == expected
+
+
+async def test_x_forwarded_filtered_stops_at_untrusted() -> None:
+    # Addresses left of the first untrusted one are never parsed
+    value = ", ".join(["garbage"] * 10000 + ["1.1.1.1", "127.0.0.1"])
+    req = make_mocked_request("GET", "/", headers={"X-Forwarded-For": value})
+    tool = XForwardedFiltered(["127.0.0.1"])
+    assert await tool.process(req) == {"remote": "1.1.1.1"}
+
+
+async def test_x_forwarded_filtered_invalid_scanned_ip() -> None:
+    req = make_mocked_request(
+        "GET", "/", headers={"X-Forwarded-For": "garbage, 127.0.0.1"}
+    )
+    with pytest.raises(web.HTTPBadRequest):
+        await XForwardedFiltered(["127.0.0.1"]).process(req)
+
+
 def test_x_forwarded_filtered_invalid_config() -> None:
     for invalid in ("127.0.0.1", "10.0.0.0/8", 42):
         with pytest.raises(TypeError):
@@ -423,6 +574,30 @@ async def test_x_forwarded_strict_untrusted_ip(aiohttp_client: AiohttpClient) ->
     assert resp.status == 400
 
 
+async def test_x_forwarded_strict_rejections(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    tool = XForwardedStrict([["127.0.0.1"]])
+    other = XForwardedStrict([["127.0.0.1"]])
+    assert tool.rejections == {}
+    before = rejections()
+    app = web.Application()
+    app.router.add_get("/", handler)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10, 11.11.11.11"})
+    assert resp.status == 400
+    resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10, 11.11.11.11"})
+    assert resp.status == 400
+    resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10"})
+    assert resp.status == 200
+    assert tool.rejections == {"IncorrectIPCount": 2}
+    assert other.rejections == {}
+    after = rejections()
+    assert after["IncorrectIPCount"] - before.get("IncorrectIPCount", 0) == 2
+
+
 async def test_x_forwarded_strict_whitelist(aiohttp_client: AiohttpClient) -> None:
     async def handler(request: web.Request) -> web.Response:
         assert request.remote == "127.0.0.1"
@@ -434,3 +609,168 @@ async def test_x_forwarded_strict_whitelist(aiohttp_client: AiohttpClient) -> No
     cl = await aiohttp_client(app)
     resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10"})
     assert resp.status == 200
+
+
+async def test_x_forwarded_strict_verdict_cache(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = XForwardedStrict([["127.0.0.1"], ["11.11.11.11"]], verdict_cache_size=16)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(3):
+        resp = await cl.get(
+            "/", headers={"X-Forwarded-For": "10.10.10.10, 11.11.11.11"}
+        )
+        assert resp.status == 200
+    assert tool.verdict_cache is not None
+    # the peer verdict comes from the per-connection cache
+    assert (tool.verdict_cache.hits, tool.verdict_cache.misses) == (2, 1)
+
+
+async def test_x_forwarded_strict_peer_cache(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = XForwardedStrict([["127.0.0.1"]])
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(3):
+        resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10"})
+        assert resp.status == 200
+    assert len(tool._peer_cache) == 1
+    await cl.close()
+    gc.collect()
+    assert len(tool._peer_cache) == 0
+
+
+async def test_x_forwarded_strict_peer_cache_untrusted(
+    aiohttp_client: AiohttpClient,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = XForwardedStrict([["20.20.20.20"]])
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(2):
+        resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10"})
+        assert resp.status == 400
+
+
+def test_x_forwarded_verdict_cache_disabled() -> None:
+    assert XForwardedStrict([["127.0.0.1"]]).verdict_cache is None
+    assert XForwardedFiltered(["127.0.0.1"]).verdict_cache is None
+
+
+async def test_x_forwarded_filtered_verdict_cache(
+    aiohttp_client: AiohttpClient,
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = XForwardedFiltered({"11.0.0.0/8"}, verdict_cache_size=16)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(2):
+        resp = await cl.get(
+            "/", headers={"X-Forwarded-For": "10.10.10.10, 11.11.11.11"}
+        )
+        assert resp.status == 200
+    assert tool.verdict_cache is not None
+    assert (tool.verdict_cache.hits, tool.verdict_cache.misses) == (2, 2)
+
+
+async def test_x_forwarded_header_cache(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        assert request.remote == "10.10.10.10"
+        assert request.scheme == "https"
+        assert request.host == "example.com"
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = XForwardedRelaxed(header_cache_size=16)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    headers = {
+        "X-Forwarded-For": "10.10.10.10",
+        "X-Forwarded-Proto": "https",
+        "X-Forwarded-Host": "example.com",
+    }
+    for _ in range(2):
+        resp = await cl.get("/", headers=headers)
+        assert resp.status == 200
+    cache = tool.header_cache
+    assert cache is not None
+    assert (cache.hits, cache.misses, len(cache)) == (3, 3, 3)
+    assert cache.nbytes == len("10.10.10.10https" "example.com")
+
+
+async def test_x_forwarded_header_cache_invalid(aiohttp_client: AiohttpClient) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()  # pragma: no cover
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = XForwardedStrict([["127.0.0.1"]], header_cache_size=16)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    for _ in range(2):
+        resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10, garbage"})
+        assert resp.status == 400
+        assert resp.reason == "Invalid X-Forwarded-For header"
+    cache = tool.header_cache
+    assert cache is not None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_x_forwarded_header_cache_disabled() -> None:
+    assert XForwardedRelaxed().header_cache is None
+    assert XForwardedFiltered(["127.0.0.1"]).header_cache is None
+    assert XForwardedStrict([["127.0.0.1"]]).header_cache is None
+    tool = XForwardedFiltered(["127.0.0.1"], header_cache_size=1, header_cache_bytes=8)
+    assert tool.header_cache is not None
+    assert tool.header_cache.maxbytes == 8
+
+
+@pytest.mark.parametrize(
+    "factory",
+    [
+        XForwardedRelaxed,
+        partial(XForwardedFiltered, ["127.0.0.1"]),
+        partial(XForwardedFiltered, ["127.0.0.1"], header_cache_size=4),
+        partial(XForwardedStrict, [["127.0.0.1"]]),
+    ],
+)
+async def test_x_forwarded_header_limits(
+    aiohttp_client: AiohttpClient, factory: Callable[..., XForwardedBase]
+) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    tool = factory(max_header_size=64, max_elements=3)
+    await _setup(app, tool)
+    cl = await aiohttp_client(app)
+    resp = await cl.get("/", headers={"X-Forwarded-For": "10.10.10.10"})
+    assert resp.status == 200
+    resp = await cl.get("/", headers={"X-Forwarded-For": "1" * 65})
+    assert resp.status == 400
+    headers = {"X-Forwarded-For": "10.10.10.10", "X-Forwarded-Proto": "a,b,c,d"}
+    resp = await cl.get("/", headers=headers)
+    assert resp.status == 400
+    assert tool.header_limits.headers_too_large == 1
+    assert tool.header_limits.too_many_elements == 1